@@ -6,16 +6,53 @@ When that was done, it escalated to Bluetooth.
 Then it went bananas over Storage and WiFi.
 """
 
-from queue import Queue
+import time
+# The startup timeline includes the imports
+STARTED = time.monotonic()
+
+from collections import deque
+import os
+import threading
 import subprocess
 
-from .event import GeneralEventManager, EventTypes, EventCodes
-from .remote import Remote, KeyCodes as RemoteCodes
+from .event import Reactor, GeneralEventManager
+from .remote import Remote
+from .keymap import Keymap
 from .menu import Menu
-from .bluetooth import Bluetooth
-from .wifi import WiFi
+from .render import AnsiRenderer
+from .bluetooth import Bluetooth, Reconnector
+from .bluez import BluezBluetooth
+from .wifi import WiFi, NetworkMonitor
 from .storage import Storage
 
+class Timeline:
+	"""Time of each step since startup."""
+	def __init__(self, start=None):
+		self.start = start if start else time.monotonic()
+		self.marks = []
+
+	def mark(self, name):
+		self.marks.append((name, time.monotonic() - self.start))
+
+	def __str__(self):
+		return "\n".join("{:8.3f} {}".format(t, name) for name, t in self.marks)
+
+class Lazy:
+	"""Creates the wrapped object on first use."""
+	def __init__(self, create):
+		self._create = create
+		self._obj = None
+		self._lock = threading.Lock()
+
+	def get(self):
+		with self._lock:
+			if self._obj is None:
+				self._obj = self._create()
+			return self._obj
+
+	def __call__(self):
+		self.get()()
+
 class Runner:
 	"""A wrapper around a boolean value in order to make it callable."""
 	def __init__(self, b=True):
@@ -27,22 +64,120 @@ class Runner:
 	def __bool__(self):
 		return self.__run
 
+class EventQueue:
+	"""
+	Bounded queue of (action, value) events.
+	The oldest move is dropped when full, so that enter and back
+	are kept. When merging, consecutive moves are merged into one
+	net move.
+	"""
+	DROP_OLDEST = "drop-oldest"
+	MERGE = "merge"
+	def __init__(self, size=32, policy=MERGE):
+		self._queue = deque()
+		self._size = size
+		self._cond = threading.Condition()
+		self.policy = policy
+		self.enqueued = 0
+		self.merged = 0
+		self.dropped = 0
+
+	def put(self, event):
+		with self._cond:
+			self.enqueued += 1
+			if self.policy == self.MERGE and event[0] == 0 and self._queue and self._queue[-1][0] == 0:
+				self.merged += 1
+				value = self._queue[-1][1] + event[1]
+				if value:
+					self._queue[-1] = (0, value)
+				else:
+					self._queue.pop()
+				return
+			if len(self._queue) >= self._size:
+				self.dropped += 1
+				if not self._make_room(event):
+					return
+			self._queue.append(event)
+			self._cond.notify()
+
+	def _make_room(self, event):
+		"""Drops the oldest move, or the oldest action if only actions."""
+		for i, queued in enumerate(self._queue):
+			if queued[0] == 0:
+				del self._queue[i]
+				return True
+		# Rather lose the new move than an action
+		if event[0] == 0:
+			return False
+		self._queue.popleft()
+		return True
+
+	def get(self):
+		with self._cond:
+			while not self._queue:
+				self._cond.wait()
+			return self._queue.popleft()
+
+	def drain(self):
+		"""
+		Waits for events, then takes all pending moves up to
+		and including the first other event.
+		"""
+		with self._cond:
+			while not self._queue:
+				self._cond.wait()
+			events = []
+			while self._queue:
+				event = self._queue.popleft()
+				events.append(event)
+				if event[0] != 0:
+					break
+			return events
+
+	def reset(self):
+		with self._cond:
+			self._queue.clear()
+
+	def stats(self):
+		return {"enqueued": self.enqueued, "merged": self.merged, "dropped": self.dropped}
+
 class Input:
 	"""Handle input events."""
 	DELTA_PRESS = 0.6
 	DELTA_RELEASE = 0.5
-	ENTER = [EventCodes.BTN_A, EventCodes.KEY_ENTER, EventCodes.BTN_LEFT]
-	BACK = [EventCodes.BTN_B, EventCodes.KEY_ESC, EventCodes.BTN_RIGHT]
-	def __init__(self):
-		self.queue = Queue()
+	DELTA = (DELTA_PRESS, DELTA_RELEASE)
+	def __init__(self, keymap=None, queue=None):
+		self.queue = queue if queue else EventQueue()
 		self.ldir = 0
+		# Press and release thresholds by device name
+		self.thresholds = {}
+		self.keymap = keymap if keymap else Keymap()
+		actions = {
+			"enter": self._enter,
+			"back": self._back,
+			"up": self._up,
+			"down": self._down,
+			"direction": self._direction,
+			"axis": self._axis
+		}
+		self._dispatch = {key: actions[action] for key, action in self.keymap.table.items()}
+
+	@property
+	def interest(self):
+		"""Events that are handled, the rest can be filtered out."""
+		return self.keymap.interest()
+
+	def set_thresholds(self, name, press=DELTA_PRESS, release=DELTA_RELEASE):
+		self.thresholds[name] = (press, release)
 
 	def get(self):
 		return self.queue.get()
 
+	def drain(self):
+		return self.queue.drain()
+
 	def reset(self):
-		with self.queue.mutex:
-			self.queue.queue.clear()
+		self.queue.reset()
 
 	def up(self):
 		self.queue.put((0, -1))
@@ -56,65 +191,64 @@ class Input:
 	def back(self):
 		self.queue.put((2, True))
 
-	def _direction(self, value):
+	def _enter(self, ctrl, code, value):
+		if value:
+			self.enter()
+
+	def _back(self, ctrl, code, value):
+		if value:
+			self.back()
+
+	def _up(self, ctrl, code, value):
+		if value:
+			self.up()
+
+	def _down(self, ctrl, code, value):
+		if value:
+			self.down()
+
+	def _direction(self, ctrl, code, value):
 		if value > 0:
 			self.down()
 		elif value < 0:
 			self.up()
 
+	def _axis(self, ctrl, code, value):
+		# Ranges are unknown until the device has been probed
+		if not ctrl.probed:
+			return
+		axis = ctrl.axes.get(code)
+		if axis:
+			value = axis.normalize(value)
+		press, release = self.thresholds.get(ctrl.name, self.DELTA)
+		if value > press:
+			if self.ldir <= 0:
+				self.ldir = 1
+				self.down()
+		elif value < -press:
+			if self.ldir >= 0:
+				self.ldir = -1
+				self.up()
+		# Center
+		elif release > value > -release:
+			self.ldir = 0
+
 	def update(self, ctrl, evtype, code, value):
-		if evtype == EventTypes.EV_KEY:
-			if code in self.ENTER:
-				if value:
-					self.enter()
-			elif code in self.BACK:
-				if value:
-					self.back()
-			elif code == EventCodes.KEY_DOWN:
-				if value:
-					self.down()
-			elif code == EventCodes.KEY_UP:
-				if value:
-					self.up()
-		elif evtype == EventTypes.EV_REL:
-			if code == EventCodes.REL_WHEEL:
-				self._direction(value)
-		elif evtype == EventTypes.EV_ABS:
-			if code == EventCodes.ABS_HAT0Y:
-				self._direction(value)
-			elif code in [EventCodes.ABS_Y, EventCodes.ABS_RZ]:
-				if evtype in ctrl.capabilities and code in ctrl.capabilities[evtype]:
-					capability = ctrl.capabilities[evtype][code]
-					# According to the documentation, this is needed to be done as there
-					# are no such modification within the kernel
-					value = max(capability.minimum, min(value, capability.maximum))
-					half = (capability.maximum - capability.minimum) / 2.0
-					value = (value if capability.minimum < 0 else value - half) / half
-				if value > self.DELTA_PRESS:
-					if self.ldir <= 0:
-						self.ldir = 1
-						self.down()
-				elif value < -self.DELTA_PRESS:
-					if self.ldir >= 0:
-						self.ldir = -1
-						self.up()
-				# Center
-				elif self.DELTA_RELEASE > value > -self.DELTA_RELEASE:
-					self.ldir = 0
+		handler = self._dispatch.get((Keymap.EVENT, evtype, code))
+		if handler:
+			handler(ctrl, code, value)
+
+	def update_batch(self, ctrl, batch):
+		dispatch = self._dispatch
+		for _, _, evtype, code, value in batch:
+			handler = dispatch.get((Keymap.EVENT, evtype, code))
+			if handler:
+				handler(ctrl, code, value)
 
 	def update_remote(self, code, value):
-		if code == RemoteCodes.KEY_OK:
-			if value:
-				self.enter()
-		elif code == RemoteCodes.KEY_BACK:
-			if value:
-				self.back()
-		elif code == RemoteCodes.KEY_DOWN:
-			if value:
-				self.down()
-		elif code == RemoteCodes.KEY_UP:
-			if value:
-				self.up()
+		handler = self._dispatch.get((Keymap.REMOTE, 0, code))
+		if handler:
+			handler(None, code, value)
 
 class InteractiveMenu:
 	"""An interactive menu shell."""
@@ -122,32 +256,67 @@ class InteractiveMenu:
 		self._runner = Runner()
 		self.input_ctrl = input_ctrl
 		self.menu = menu
+		# Events handled by the last batch, and the time from receiving
+		# them until drawn, unless they executed an item
+		self.batch_size = 0
+		self.draw_time = 0.0
+		# From opening until the first frame is drawn
+		self.open_time = None
 
 	def __call__(self):
+		opened = time.monotonic()
 		self._runner(True)
+		self.load()
 
+		previous = self.menu.get_parent().active
+		self.menu.show()
+		self.menu.get_parent().after_frame(lambda end: self._opened(end - opened))
 		self.draw()
 
 		while self._runner:
+			events = self.input_ctrl.drain()
+			start = time.monotonic()
 			vec = 0
-			select = False
-			action, value = self.input_ctrl.get()
-			if action == 0:
-				vec = value
-			elif action == 1:
-				select = True
-			elif action == 2:
-				self.exit()
 			update = False
+			executed = False
+			for action, value in events:
+				if action == 0:
+					vec += value
+					continue
+				# Keep the order of moves and actions
+				if vec != 0:
+					self.menu.jump(vec)
+					vec = 0
+					update = True
+				if action == 1:
+					self.menu.execute()
+					update = True
+					executed = True
+				elif action == 2:
+					self.exit()
 			if vec != 0:
 				self.menu.jump(vec)
 				update = True
-			if select:
-				self.menu.execute()
-				update = True
+			self.batch_size = len(events)
 			if update:
+				# Sub menus opened by execute are not part of it
+				if not executed:
+					self.menu.get_parent().after_frame(lambda end, start=start: self._drawn(end - start))
 				self.draw()
 
+		if previous:
+			previous.show()
+
+	def load(self):
+		"""Fills the menu before it is shown."""
+		pass
+
+	def _opened(self, open_time):
+		self.open_time = open_time
+
+	def _drawn(self, draw_time):
+		self.draw_time = draw_time
+
 	def draw(self):
 		self.menu.draw()
 
@@ -160,34 +329,57 @@ class InteractiveMenu:
 
 class MainMenu(InteractiveMenu):
 	"""The main menu."""
-	def __init__(self, menu, input_ctrl):
+	def __init__(self, menu, input_ctrl, warm_up=True):
 		super().__init__(menu.sub_menu(), input_ctrl)
+		self.warm_up = warm_up
+		# Created on first selection
+		self.sub_menus = [
+			Lazy(lambda: BluetoothMenu(menu.sub_menu(), input_ctrl)),
+			Lazy(lambda: WiFiMenu(menu.sub_menu(), input_ctrl)),
+			Lazy(lambda: StorageMenu(menu.sub_menu(), input_ctrl))
+		]
 		self.menu.add("0", "Shutdown", create_cmd_input("sudo shutdown now"))
 		self.menu.add("1", "Steamlink", create_cmd_input("steamlink"), True)
 		self.menu.add("2", "RetroPie", create_cmd_input("emulationstation"))
-		self.menu.add("3", "Bluetooth", BluetoothMenu(menu.sub_menu(), input_ctrl))
-		self.menu.add("4", "WiFi", WiFiMenu(menu.sub_menu(), input_ctrl))
-		self.menu.add("5", "Storage", StorageMenu(menu.sub_menu(), input_ctrl))
+		self.menu.add("3", "Bluetooth", self.sub_menus[0])
+		self.menu.add("4", "WiFi", self.sub_menus[1])
+		self.menu.add("5", "Storage", self.sub_menus[2])
+
+	def __call__(self):
+		if self.warm_up:
+			threading.Thread(target=self.create_sub_menus, daemon=True).start()
+		super().__call__()
+
+	def create_sub_menus(self):
+		"""Creates the sub menus in the background once visible."""
+		self.menu.get_parent().visible.wait()
+		for sub_menu in self.sub_menus:
+			sub_menu.get()
 
 	def exit(self):
 		pass # Disable
 
 class BluetoothMenu(InteractiveMenu):
 	"""Managing bluetooth devices."""
+	PROGRESS = {"pairing": ".", "trusting": ".", "connecting": ":", "failed": "!"}
+
 	def __init__(self, menu, input_ctrl):
 		super().__init__(menu, input_ctrl)
-		self.bt = Bluetooth()
-		self.paired = self.bt.get_paired()
-		self.pair_exist = lambda dev: dev in [pair[0] for pair in self.paired]
-		self.fpair = lambda dev: "*" if self.pair_exist(dev) else " "
+		self.bt = bluetooth.get()
+		self.devices = self.bt.refresh()
+		self.pair_exist = lambda dev: dev in self.devices and self.devices.get(dev).paired
+		self.progress = {}
+		self.fpair = lambda dev: self.PROGRESS.get(self.progress.get(dev), "*" if self.pair_exist(dev) else " ")
 
 	def __call__(self):
 		self.load_menu()
 		self.menu.draw()
 
-		self.bt.scan(self.add_device)
+		self.devices.subscribers.append(self.device_changed)
+		self.bt.scan()
 		super().__call__()
 		self.bt.cancel()
+		self.devices.subscribers.remove(self.device_changed)
 
 	def handle_device(self, dev):
 		if self.pair_exist(dev):
@@ -195,23 +387,29 @@ class BluetoothMenu(InteractiveMenu):
 			self.bt.remove_device(dev)
 		else:
 			print("Connecting device...")
-			self.bt.trust_device(dev)
-		# Refresh list
-		self.paired = self.bt.get_paired()
-		# TODO: Make smarter, don't update the whole list
-		self.load_menu()
-		self.menu.draw()
+			self.bt.pair_device(dev, self.pair_progress)
+
+	def pair_progress(self, dev, state):
+		self.progress[dev] = state
+		device = self.devices.get(dev)
+		if device:
+			self.add_device(dev, device.name)
+
+	def device_changed(self, kind, device):
+		if kind == "delete":
+			self.menu.remove(device.mac)
+		else:
+			self.add_device(device.mac, device.name)
 
 	def load_menu(self, draw=False):
 		self.menu.clear()
 		self.menu.add("X", "Back", self.runner)
-		devs = self.bt.get_devices()
-		devs.sort(key=lambda pair: pair[1])
-		for pair in devs:
-			self.add_device(*pair, draw)
+		self.bt.refresh()
+		for device in sorted(self.devices, key=lambda device: device.name):
+			self.add_device(device.mac, device.name, draw)
 
 	def add_device(self, address, name, draw=True):
-		self.menu.add(self.fpair(address), name, lambda: self.handle_device(address))
+		self.menu.upsert(address, self.fpair(address), name, lambda: self.handle_device(address))
 		if draw:
 			self.menu.draw()
 
@@ -219,25 +417,93 @@ class WiFiMenu(InteractiveMenu):
 	"""Managing WiFi connection."""
 	def __init__(self, menu, input_ctrl):
 		super().__init__(menu, input_ctrl)
-		self.wifi = WiFi()
+		self.wifi = WiFi(network.get())
+		# Network being connected, and if NetworkManager has started on it
+		self.connecting = None
+		self.attempting = False
 
 	def __call__(self):
-		self.menu.clear()
-
-		self.menu.add("Abort", "Scanning proximity...", self.runner)
-		self.menu.draw()
+		self.wifi.monitor.subscribers.append(self.network_changed)
+		super().__call__()
+		self.wifi.monitor.subscribers.remove(self.network_changed)
 
-		networks = self.wifi.get_networks()
+	def load(self):
+		self.menu.clear()
+		# Cached networks are shown at once, and updated when scanned
+		networks = self.wifi.scan(self.scanned)
+		if networks is None:
+			self.menu.add("Abort", "Scanning proximity...", self.runner)
+		else:
+			self.menu.add("X", "Back", self.runner)
+			self.load_networks(networks)
 
+	def scanned(self, networks):
+		if networks is None:
+			networks = []
 		self.menu.update(0, key="X", text="Back")
-
-		for network in networks:
-			self.menu.add("*" if network["in-use"] else " ", network["ssid"], lambda: self.connect(network))
-
-		super().__call__()
+		self.load_networks(networks)
+
+	def load_networks(self, networks):
+		"""Updates the rows in place, keyed by SSID."""
+		ids = [self.network_id(network) for network in networks]
+		order = {id: i for i, id in enumerate(ids)}
+		with self.menu.get_parent().lock:
+			for id, network in zip(ids, networks):
+				self.menu.upsert(id, "*" if network["in-use"] else " ", network["ssid"], lambda network=network: self.connect(network))
+			for item in self.menu.menu[1:]:
+				if item.id not in order:
+					self.menu.remove(item.id)
+			# Strongest first
+			self.menu.sort(lambda item: order[item.id], 1)
+		self.menu.draw()
 
 	def connect(self, network):
-		self.wifi.connect(network["bssid"])
+		# Progress is shown as the monitor sees it
+		self.connecting = network
+		self.attempting = False
+		threading.Thread(target=self._connect, args=(network,), daemon=True).start()
+
+	def _connect(self, network):
+		connected = self.wifi.connect(network["ssid"], bssid=network["bssid"])
+		# Finished before the monitor saw it
+		if self.connecting is network:
+			self.connected(network, connected)
+
+	def network_changed(self, kind, value):
+		network = self.connecting
+		if kind != "device" or not network:
+			return
+		device, state = value
+		if device not in self.wifi.monitor.wifi_devices():
+			return
+		if state.startswith("connecting"):
+			self.attempting = True
+			self.menu.upsert(self.network_id(network), ":", "{} ({})".format(network["ssid"], state))
+			self.menu.draw()
+		# The previous network is disconnected first, before connecting
+		elif state == "connected" and self.attempting:
+			self.connected(network, True)
+		elif state == "disconnected" and self.attempting:
+			self.connected(network, False)
+
+	def connected(self, network, success):
+		self.connecting = None
+		id = self.network_id(network)
+		with self.menu.get_parent().lock:
+			if self.menu.find(id) is None:
+				return
+			if success:
+				for item in self.menu.menu[1:]:
+					self.menu.upsert(item.id, "*" if item.id == id else " ")
+				self.menu.upsert(id, text=network["ssid"])
+			else:
+				self.menu.upsert(id, "!", network["ssid"])
+		self.menu.draw()
+
+	@staticmethod
+	def network_id(network):
+		# Hidden networks are only known by their BSSID
+		return network["ssid"] if network["ssid"] else network["bssid"]
 
 class StorageMenu(InteractiveMenu):
 	"""
@@ -248,7 +514,7 @@ class StorageMenu(InteractiveMenu):
 	"""
 	def __init__(self, menu, input_ctrl):
 		super().__init__(menu, input_ctrl)
-		self.storage = Storage()
+		self.storage = Storage(network.get())
 		self.menu.add("X", "Back", self.runner)
 		self.menu.add(" ", "Mounted", self.storage.connect)
 		self.menu.add(" ", "VPN", self.vpn)
@@ -287,17 +553,61 @@ def input_resume():
 	menu.resume()
 	remote.resume()
 	input_manager.resume()
+	# Controllers might have been turned off meanwhile
+	reconnector.get().start()
 
 create_cmd_input = lambda cmd: create_cmd(cmd, input_pause, input_resume)
 
-input_ctrl = Input()
-input_manager = GeneralEventManager(input_ctrl.update)
-remote = Remote(input_ctrl.update_remote)
+timeline = Timeline(STARTED)
+timeline.mark("import")
+
+input_ctrl = Input(Keymap.load())
+reactor = None
+input_manager = None
+remote = None
+def create_bluetooth():
+	"""BlueZ over D-Bus when PI_LOUNGE_BLUETOOTH is dbus, else bluetoothctl."""
+	if os.environ.get("PI_LOUNGE_BLUETOOTH") == "dbus" and BluezBluetooth.available():
+		return BluezBluetooth()
+	return Bluetooth()
+
+# Shared by the menu and the reconnects
+bluetooth = Lazy(create_bluetooth)
+reconnector = Lazy(lambda: Reconnector(bluetooth.get()))
+network = Lazy(NetworkMonitor)
 
-menu = Menu()
+# Plain escape sequences are lighter on slow machines
+menu = Menu(renderer=AnsiRenderer() if os.environ.get("PI_LOUNGE_RENDERER") == "ansi" else None)
+
+def trace():
+	"""
+	Writes the startup timeline to the file in PI_LOUNGE_TRACE
+	once the menu is visible, and compares it with the target
+	in PI_LOUNGE_TARGET, in seconds.
+	"""
+	menu.visible.wait()
+	timeline.mark("first draw")
+	path = os.environ.get("PI_LOUNGE_TRACE")
+	if not path:
+		return
+	report = str(timeline)
+	target = os.environ.get("PI_LOUNGE_TARGET")
+	if target and timeline.marks[-1][1] > float(target):
+		report += "\nTarget of {}s exceeded".format(target)
+	with open(path, "w") as f:
+		f.write(report + "\n")
 
 def main():
+	global reactor, input_manager, remote
+	threading.Thread(target=trace, daemon=True).start()
 	with menu:
+		timeline.mark("curses init")
+		reactor = Reactor()
+		input_manager = GeneralEventManager(input_ctrl.update, reactor, input_ctrl.update_batch, input_ctrl.interest, True)
+		# Controllers are often turned on together with the TV
+		remote = Remote(input_ctrl.update_remote, lambda: reconnector.get().start())
+		timeline.mark("device probe")
+		reconnector.get().start()
 		MainMenu(menu, input_ctrl)()
 
 if __name__ == "__main__":
@@ -305,4 +615,3 @@ if __name__ == "__main__":
 		main()
 	except KeyboardInterrupt:
 		pass
-
@@ -1,57 +1,415 @@
+import os
 import threading
-from subprocess import Popen, PIPE
+import time
+from subprocess import Popen, PIPE, DEVNULL
 import re
 
+# Colors, cursor movement and readline markers
+ANSI = re.compile(r'\x1b\[[0-9;?]*[A-Za-z]|[\r\x01\x02]')
+# Such as "[bluetooth]# " or "[Controller]> "
+PROMPT = re.compile(r'\[[^\]]*\][#>] ?')
+EVENT = re.compile(r'\[(NEW|CHG|DEL)\] ')
+DEVICE = re.compile(r'Device (([0-9a-fA-F]{2}:){5}[0-9a-fA-F]{2}) ?(.*)')
+DEVICE_EVENT = re.compile(r'\[(NEW|CHG|DEL)\] Device ((?:[0-9a-fA-F]{2}:){5}[0-9a-fA-F]{2}) ?(.*)')
+# Such as "-60" or "0xffffffc4 (-60)"
+RSSI = re.compile(r'(-?\d+)\)?$')
+
+class BluetoothDevice:
+	"""
+	State of a bluetooth device.
+	"""
+	__slots__ = ('mac', 'name', 'paired', 'trusted', 'connected', 'rssi')
+
+	def __init__(self, mac):
+		self.mac = mac
+		self.name = mac
+		self.paired = False
+		self.trusted = False
+		self.connected = False
+		self.rssi = None
+
+	def __repr__(self):
+		return "BluetoothDevice({}, {})".format(self.mac, self.name)
+
+class DeviceRegistry:
+	"""
+	Bluetooth devices by MAC address.
+	Updated in place from [NEW], [CHG] and [DEL] events, and
+	subscribers are called with ("new"|"change"|"delete", device).
+	"""
+	def __init__(self):
+		self._devices = {}
+		self._lock = threading.RLock()
+		self._changed = threading.Condition(self._lock)
+		self.subscribers = []
+
+	def get(self, mac):
+		return self._devices.get(mac)
+
+	def __contains__(self, mac):
+		return mac in self._devices
+
+	def __iter__(self):
+		return iter(list(self._devices.values()))
+
+	def __len__(self):
+		return len(self._devices)
+
+	def update(self, mac, **fields):
+		with self._lock:
+			device = self._devices.get(mac)
+			kind = "change"
+			if not device:
+				device = self._devices[mac] = BluetoothDevice(mac)
+				kind = "new"
+			changed = kind == "new"
+			for field, value in fields.items():
+				if getattr(device, field) != value:
+					setattr(device, field, value)
+					changed = True
+			if changed:
+				self._changed.notify_all()
+		if changed:
+			self._notify(kind, device)
+		return device
+
+	def remove(self, mac):
+		with self._lock:
+			device = self._devices.pop(mac, None)
+		if device:
+			self._notify("delete", device)
+
+	def wait(self, mac, field, timeout):
+		"""Waits for a field of a device to become true."""
+		def done():
+			device = self._devices.get(mac)
+			return device is not None and getattr(device, field)
+		with self._changed:
+			return self._changed.wait_for(done, timeout)
+
+	def _notify(self, kind, device):
+		for subscriber in list(self.subscribers):
+			subscriber(kind, device)
+
+	def feed(self, line):
+		"""Updates from an event line of bluetoothctl."""
+		m = DEVICE_EVENT.match(line)
+		if not m:
+			return
+		event, mac, rest = m.groups()
+		if event == "NEW":
+			self.update(mac, name=rest if rest else mac)
+		elif event == "DEL":
+			self.remove(mac)
+		elif ": " in rest:
+			key, value = rest.split(": ", 1)
+			if key in ("Name", "Alias"):
+				self.update(mac, name=value)
+			elif key in ("Paired", "Trusted", "Connected"):
+				self.update(mac, **{key.lower(): value == "yes"})
+			elif key == "RSSI":
+				m = RSSI.search(value)
+				if m:
+					self.update(mac, rssi=int(m.group(1)))
+
+class BluetoothCtl:
+	"""
+	A long lived bluetoothctl session, shared by all commands.
+	Commands are serialized and their response ends at the first
+	prompt after the echo of the command. Other lines, such as
+	[NEW] events, are given to the listeners. Restarted if the
+	process dies.
+	"""
+	TIMEOUT = 5.0
+
+	def __init__(self):
+		self._lock = threading.Lock()
+		self._cond = threading.Condition()
+		self._process = None
+		self._response = None
+		self._command = None
+		self._echoed = False
+		self._prompt = False
+		self._after_event = False
+		self.listeners = []
+
+	def _start(self):
+		if self._process and self._process.poll() is None:
+			return
+		with self._cond:
+			self._prompt = False
+		self._process = Popen(["bluetoothctl"], stdin=PIPE, stdout=PIPE, stderr=DEVNULL)
+		threading.Thread(target=self._read, args=(self._process,), daemon=True).start()
+		# Wait for it to be ready
+		with self._cond:
+			self._cond.wait_for(lambda: self._prompt, 1.0)
+
+	def _read(self, process):
+		fd = process.stdout.fileno()
+		buf = b''
+		while True:
+			data = os.read(fd, 4096)
+			if not data:
+				break
+			buf += data
+			*lines, buf = buf.split(b'\n')
+			for line in lines:
+				self._line(line.decode('utf-8', 'replace'))
+			# The prompt is not followed by a newline
+			if PROMPT.fullmatch(ANSI.sub('', buf.decode('utf-8', 'replace')).strip() + " "):
+				buf = b''
+				# Redrawn after each event, which does not end a response
+				if not self._after_event:
+					self._prompted()
+		with self._cond:
+			self._echoed = True
+		self._prompted()
+
+	def _prompted(self):
+		"""A prompt ends the response once the command has been echoed."""
+		with self._cond:
+			if self._response is None or self._echoed:
+				self._prompt = True
+				self._cond.notify_all()
+
+	def _line(self, raw):
+		line = self.clean(raw)
+		if not line:
+			return
+		# The line was written after a prompt
+		if line != ANSI.sub('', raw).strip():
+			self._prompted()
+		self._after_event = bool(EVENT.match(line))
+		if self._after_event:
+			for listener in list(self.listeners):
+				listener(line)
+			return
+		with self._cond:
+			if self._response is None:
+				return
+			if not self._echoed:
+				# Output before the echo belongs to earlier commands
+				self._echoed = line == self._command
+			elif not self._prompt:
+				self._response.append(line)
+
+	@staticmethod
+	def clean(line):
+		line = ANSI.sub('', line).strip()
+		# Prompts printed before the line
+		while True:
+			m = PROMPT.match(line)
+			if not m:
+				return line
+			line = line[m.end():].strip()
+
+	def command(self, *args, timeout=TIMEOUT):
+		"""
+		Runs a command and returns the lines of its response.
+		"""
+		cmd = " ".join(args)
+		with self._lock:
+			for retry in [True, False]:
+				self._start()
+				with self._cond:
+					self._response = []
+					self._command = cmd
+					self._echoed = False
+					self._prompt = False
+				try:
+					self._process.stdin.write(cmd.encode('utf-8') + b"\n")
+					self._process.stdin.flush()
+					break
+				except OSError:
+					# Died, try with a new process
+					self._process.kill()
+					if not retry:
+						raise
+			with self._cond:
+				self._cond.wait_for(lambda: self._prompt, timeout)
+				response, self._response = self._response, None
+		return response
+
+	def close(self):
+		if self._process and self._process.poll() is None:
+			self._process.stdin.close()
+			self._process.terminate()
+			self._process.wait()
+
+class Pairing:
+	"""
+	Pairs, trusts and connects a device in a thread.
+	Each step waits for the state change of the device instead
+	of a fixed time, and progress(mac, state) is called with
+	"pairing", "trusting", "connecting", "connected" or "failed".
+	"""
+	STEPS = [
+		("pair", "paired", "pairing"),
+		("trust", "trusted", "trusting"),
+		("connect", "connected", "connecting"),
+	]
+
+	def __init__(self, bt, mac, progress=None, timeout=30.0):
+		self.bt = bt
+		self.mac = mac
+		self.progress = progress
+		self.timeout = timeout
+		self.state = None
+		self._done = threading.Event()
+		self._thread = threading.Thread(target=self._run, daemon=True)
+
+	def start(self):
+		self._thread.start()
+		return self
+
+	def _report(self, state):
+		self.state = state
+		if self.progress:
+			self.progress(self.mac, state)
+
+	def _run(self):
+		registry = self.bt.registry
+		deadline = time.monotonic() + self.timeout
+		try:
+			for command, field, state in self.STEPS:
+				device = registry.get(self.mac)
+				if device and getattr(device, field):
+					continue
+				self._report(state)
+				self.bt.action(command, self.mac)
+				if not registry.wait(self.mac, field, max(0, deadline - time.monotonic())):
+					self._report("failed")
+					return
+			self._report("connected")
+		except OSError:
+			self._report("failed")
+		finally:
+			self._done.set()
+
+	def done(self):
+		return self._done.is_set()
+
+	def wait(self, timeout=None):
+		"""Waits for it to finish and returns if it connected."""
+		self._done.wait(timeout)
+		return self.state == "connected"
+
+class Reconnector:
+	"""
+	Reconnects paired and trusted devices in the background,
+	all at the same time. A device that fails is retried with
+	its own backoff. The time it took until all of them were
+	connected is kept in elapsed.
+	"""
+	ATTEMPTS = 5
+	BACKOFF = 1.0
+	MAX_BACKOFF = 30.0
+
+	def __init__(self, bt, timeout=10.0):
+		self.bt = bt
+		self.timeout = timeout
+		self.elapsed = None
+		self._lock = threading.Lock()
+		self._running = set()
+
+	def start(self):
+		threading.Thread(target=self._run, daemon=True).start()
+
+	def _run(self):
+		start = time.monotonic()
+		try:
+			self.bt.refresh()
+			devices = [device for device in self.bt.registry if device.paired]
+			for device in devices:
+				self.bt.device_info(device.mac)
+		except OSError:
+			return
+		devices = [device.mac for device in devices if device.trusted]
+		with self._lock:
+			# Already being reconnected by an earlier run
+			macs = [mac for mac in devices if mac not in self._running]
+			self._running.update(macs)
+		threads = [threading.Thread(target=self._reconnect, args=(mac,), daemon=True) for mac in macs]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+		# Removed meanwhile, such as from the menu
+		devices = [self.bt.registry.get(mac) for mac in devices]
+		if all(device.connected for device in devices if device):
+			self.elapsed = time.monotonic() - start
+
+	def _reconnect(self, mac):
+		delay = self.BACKOFF
+		try:
+			for attempt in range(self.ATTEMPTS):
+				if mac not in self.bt.registry:
+					return
+				if self.bt.pair_device(mac, timeout=self.timeout).wait():
+					return
+				time.sleep(delay)
+				delay = min(delay * 2, self.MAX_BACKOFF)
+		finally:
+			with self._lock:
+				self._running.discard(mac)
 
 class Bluetooth:
 	"""
 	Handle bluetooth devices.
 	"""
-	thread = None
+	def __init__(self, ctl=None):
+		self.ctl = ctl if ctl else BluetoothCtl()
+		self.registry = DeviceRegistry()
+		self.ctl.listeners.append(self.registry.feed)
+		self.callback = None
+		self.pairings = {}
 
-	def scan(self, callback):
+	def scan(self, callback=None):
 		self.callback = callback
-		self.runner = True
-		if self.thread == None:
-			self.thread = threading.Thread(target=self.loop, daemon=True)
-			self.thread.start()
+		if self._scanned not in self.registry.subscribers:
+			self.registry.subscribers.append(self._scanned)
+		self.discover(True)
 
 	def cancel(self):
-		self.runner = False
-
-	def loop(self):
-		p = self.bluetoothctl()
-		p.stdout.readline() # Skip first
-		p.stdin.write(b"scan on\n")
-		p.stdin.flush()
-		while self.runner:
-			line = p.stdout.readline().strip().decode()
-			if not self.runner:
-				break
-			# Only take in new devices
-			if '\x1b[K[\x1b[0;92mNEW\x1b[0m]' in line:
-				m = re.findall(r'Device (([0-9a-fA-F]{2}:){5}[0-9a-fA-F]{2}) (.*)', line)[0]
-				self.callback(m[0], m[-1])
-		self.thread = None
+		if self._scanned in self.registry.subscribers:
+			self.registry.subscribers.remove(self._scanned)
+		self.discover(False)
+
+	def discover(self, on):
+		self.ctl.command("scan", "on" if on else "off")
+
+	def action(self, name, mac):
+		"""Starts to pair, trust or connect a device."""
+		self.ctl.command(name, mac)
+
+	def _scanned(self, kind, device):
+		# Only take in new devices
+		if kind == "new" and self.callback:
+			self.callback(device.mac, device.name)
+
+	def refresh(self):
+		"""Fills the registry with known and paired devices."""
+		for mac, name in self.get_devices():
+			self.registry.update(mac, name=name)
+		for mac, name in self.get_paired():
+			self.registry.update(mac, name=name, paired=True)
+		return self.registry
 
 	def get_devices(self):
-		p = self.bluetoothctl("devices")
-		p.wait()
-		return self.devices_to_list(p.stdout.readlines())
+		return self.devices_to_list(self.ctl.command("devices"))
 
 	def get_paired(self):
-		p = self.bluetoothctl("paired-devices")
-		p.wait()
-		return self.devices_to_list(p.stdout.readlines())
+		lines = self.ctl.command("paired-devices")
+		# Replaced in later versions
+		if any("Invalid command" in line for line in lines):
+			lines = self.ctl.command("devices", "Paired")
+		return self.devices_to_list(lines)
 
 	def device_info(self, mac):
-		p = self.bluetoothctl("info", mac)
-		p.wait()
 		info = {}
 		def value(line):
 			return line.split(' ', 1)[1]
-		for line in p.stdout.readlines():
-			line = line.decode('utf-8').strip()
+		for line in self.ctl.command("info", mac):
 			if line.startswith("Name"):
 				info["name"] = value(line)
 			elif line.startswith("Paired"):
@@ -60,30 +418,33 @@ class Bluetooth:
 				info["trusted"] = value(line) == "yes"
 			elif line.startswith("Connected"):
 				info["connected"] = value(line) == "yes"
+		if info:
+			self.registry.update(mac, **info)
 		return info
 
-	def trust_device(self, mac):
-		p = self.bluetoothctl("trust", mac)
-		p.wait()
-		print(p.stdout.readlines())
-		import time
-		time.sleep(5)
-		self.bluetoothctl("connect", mac).wait()
+	def pair_device(self, mac, progress=None, timeout=30.0):
+		"""
+		Starts to pair, trust and connect a device. Several
+		devices can be paired at the same time.
+		"""
+		pairing = self.pairings.get(mac)
+		if pairing and not pairing.done():
+			return pairing
+		pairing = self.pairings[mac] = Pairing(self, mac, progress, timeout)
+		return pairing.start()
+
+	def trust_device(self, mac, timeout=30.0):
+		return self.pair_device(mac, timeout=timeout).wait()
 
 	def remove_device(self, mac):
-		self.bluetoothctl("untrust", mac).wait()
-		self.bluetoothctl("remove", mac).wait()
+		self.ctl.command("untrust", mac)
+		self.ctl.command("remove", mac)
 
 	@staticmethod
-	def devices_to_list(data):
-		data = list(data)
+	def devices_to_list(lines):
 		devs = []
-		for datum in data:
-			datum = datum.decode('utf-8').strip()
-			if datum.startswith("Device"):
-				devs.append(tuple(datum[7:].split(' ', 1)))
+		for line in lines:
+			m = DEVICE.match(line)
+			if m:
+				devs.append((m.group(1), m.group(3)))
 		return devs
-
-	@staticmethod
-	def bluetoothctl(*args, **kwargs):
-		return Popen(["bluetoothctl", *args], stdin=PIPE, stdout=PIPE, bufsize=1, **kwargs)
@@ -0,0 +1,162 @@
+# BlueZ over D-Bus
+# https://dbus.freedesktop.org/doc/dbus-python/
+try:
+	import dbus
+	import dbus.mainloop.glib
+	from gi.repository import GLib
+except ImportError:
+	dbus = None
+import threading
+
+from .bluetooth import Bluetooth, DeviceRegistry
+
+BLUEZ = "org.bluez"
+ADAPTER = "org.bluez.Adapter1"
+DEVICE = "org.bluez.Device1"
+OBJECT_MANAGER = "org.freedesktop.DBus.ObjectManager"
+PROPERTIES = "org.freedesktop.DBus.Properties"
+
+# Device properties kept in the registry
+FIELDS = {
+	"Alias": "name",
+	"Paired": "paired",
+	"Trusted": "trusted",
+	"Connected": "connected",
+	"RSSI": "rssi",
+}
+
+class BluezBluetooth(Bluetooth):
+	"""
+	Handle bluetooth devices through BlueZ on the system bus.
+	The registry is kept up to date from the InterfacesAdded,
+	InterfacesRemoved and PropertiesChanged signals.
+	"""
+	# For method calls, in seconds
+	TIMEOUT = 30.0
+	_loop = None
+
+	def __init__(self, bus=None):
+		self.ctl = None
+		self.registry = DeviceRegistry()
+		self.callback = None
+		self.pairings = {}
+		self._paths = {}
+		self._macs = {}
+		self._start_loop()
+		self.bus = bus if bus else dbus.SystemBus()
+		self.bus.add_signal_receiver(self._added, signal_name="InterfacesAdded",
+			dbus_interface=OBJECT_MANAGER, bus_name=BLUEZ)
+		self.bus.add_signal_receiver(self._removed, signal_name="InterfacesRemoved",
+			dbus_interface=OBJECT_MANAGER, bus_name=BLUEZ)
+		self.bus.add_signal_receiver(self._changed, signal_name="PropertiesChanged",
+			dbus_interface=PROPERTIES, bus_name=BLUEZ, path_keyword="path", arg0=DEVICE)
+		self.adapter = None
+		for path, interfaces in self._objects().items():
+			if ADAPTER in interfaces:
+				self.adapter = dbus.Interface(self.bus.get_object(BLUEZ, path), ADAPTER)
+				break
+
+	@staticmethod
+	def available():
+		return dbus is not None
+
+	@classmethod
+	def _start_loop(cls):
+		"""Signals are handled in one shared GLib main loop."""
+		if cls._loop:
+			return
+		dbus.mainloop.glib.threads_init()
+		dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
+		cls._loop = GLib.MainLoop()
+		threading.Thread(target=cls._loop.run, daemon=True).start()
+
+	def _objects(self):
+		manager = dbus.Interface(self.bus.get_object(BLUEZ, "/"), OBJECT_MANAGER)
+		return manager.GetManagedObjects()
+
+	def _device(self, mac, interface=DEVICE):
+		path = self._paths.get(mac)
+		if not path:
+			raise OSError("Unknown device {}".format(mac))
+		return dbus.Interface(self.bus.get_object(BLUEZ, path), interface)
+
+	@staticmethod
+	def _value(value):
+		if isinstance(value, dbus.Boolean):
+			return bool(value)
+		if isinstance(value, dbus.String):
+			return str(value)
+		return int(value)
+
+	def _update(self, path, properties):
+		mac = self._macs.get(path)
+		if "Address" in properties:
+			mac = str(properties["Address"])
+			self._macs[path] = mac
+			self._paths[mac] = path
+		if not mac:
+			return
+		fields = {FIELDS[key]: self._value(value) for key, value in properties.items() if key in FIELDS}
+		self.registry.update(mac, **fields)
+
+	def _added(self, path, interfaces):
+		if DEVICE in interfaces:
+			self._update(path, interfaces[DEVICE])
+
+	def _removed(self, path, interfaces):
+		if DEVICE in interfaces:
+			mac = self._macs.pop(path, None)
+			if mac:
+				self._paths.pop(mac, None)
+				self.registry.remove(mac)
+
+	def _changed(self, interface, changed, invalidated, path=None):
+		self._update(path, changed)
+
+	def refresh(self):
+		for path, interfaces in self._objects().items():
+			self._added(path, interfaces)
+		return self.registry
+
+	def get_devices(self):
+		return [(device.mac, device.name) for device in self.refresh()]
+
+	def get_paired(self):
+		return [(device.mac, device.name) for device in self.refresh() if device.paired]
+
+	def device_info(self, mac):
+		properties = self._device(mac, PROPERTIES).GetAll(DEVICE)
+		self._update(self._paths[mac], properties)
+		device = self.registry.get(mac)
+		return {field: getattr(device, field) for field in ("name", "paired", "trusted", "connected")}
+
+	def discover(self, on):
+		if not self.adapter:
+			return
+		try:
+			if on:
+				self.adapter.StartDiscovery()
+			else:
+				self.adapter.StopDiscovery()
+		except dbus.exceptions.DBusException:
+			pass # Already in that state
+
+	def action(self, name, mac):
+		# The result is seen in the registry
+		ignore = lambda *args: None
+		handlers = dict(reply_handler=ignore, error_handler=ignore, timeout=self.TIMEOUT)
+		if name == "trust":
+			self._device(mac, PROPERTIES).Set(DEVICE, "Trusted", dbus.Boolean(True), **handlers)
+		elif name == "pair":
+			self._device(mac).Pair(**handlers)
+		elif name == "connect":
+			self._device(mac).Connect(**handlers)
+
+	def remove_device(self, mac):
+		path = self._paths.get(mac)
+		if not path or not self.adapter:
+			return
+		try:
+			self.adapter.RemoveDevice(path)
+		except dbus.exceptions.DBusException:
+			pass # Already gone
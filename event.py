@@ -1,8 +1,12 @@
 
-import os, struct, array
+import os, struct, array, json
 from fcntl import ioctl
 from inotify_simple import INotify, flags
 import threading
+import selectors
+import heapq
+import logging
+import time
 
 # Event manager and handler in order to handle devices in Linux.
 
@@ -38,6 +42,11 @@ class EventTypes:
 	EV_MAX = 0x1f
 
 class EventCodes:
+	SYN_REPORT = 0
+	SYN_CONFIG = 1
+	SYN_MT_REPORT = 2
+	SYN_DROPPED = 3
+
 	KEY_RESERVED = 0
 	KEY_ESC = 1
 	KEY_1 = 2
@@ -541,17 +550,318 @@ class ForceFeedback:
 	FF_MAX_EFFEECTS = 0x60
 	FF_MAX = 0x7f
 
+### ioctl ###
+# Note: For Raspberry Pi, this is how it works
+# From kernel <uapi/linux/ioctl.h>
+_ioc_nrbits = 8
+_ioc_typebits = 8
+_ioc_sizebits = 14 # 13 in source, but libraries uses this one
+_ioc_dirbits = 2 # 3 in source, but libraries...
+
+_ioc_nrshift = 0
+_ioc_typeshift = _ioc_nrshift+_ioc_nrbits
+_ioc_sizeshift = _ioc_typeshift+_ioc_typebits
+_ioc_dirshift = _ioc_sizeshift+_ioc_sizebits
+
+# Other libraries starts at 0
+_ioc_none = 1
+_ioc_read = 2
+_ioc_write = 3
+
+_ioc = lambda dir, type, nr, size: (
+	(dir << _ioc_dirshift) |
+	(ord(type) << _ioc_typeshift) |
+	(nr << _ioc_nrshift) |
+	(size << _ioc_sizeshift))
+_ior = lambda type, nr, size: _ioc(_ioc_read, type, nr, size)
+_iow = lambda type, nr, size: _ioc(_ioc_write, type, nr, size)
+
+eviocgversion = _ior('E', 0x01, 4)
+eviocgid = _ior('E', 0x02, 8)
+eviocgrep = _ior('E', 0x03, 8)
+eviocsrep = _iow('E', 0x04, 8)
+eviocgname = lambda len: _ioc(_ioc_read, 'E', 0x06, len)
+eviocgphys = lambda len: _ioc(_ioc_read, 'E', 0x07, len)
+eviocguniq = lambda len: _ioc(_ioc_read, 'E', 0x08, len)
+eviocgprop = lambda len: _ioc(_ioc_read, 'E', 0x09, len)
+eviocgbit = lambda ev, len: _ioc(_ioc_read, 'E', 0x20 + (ev), len)
+eviocgabs = lambda abs: _ior('E', 0x40 + abs, 48)
+eviocsff = _iow('E', 0x80, 38)
+eviocrmff = _iow('E', 0x81, 4)
+eviocgeffects = _ior('E', 0x84, 4)
+eviocgrab = _iow('E', 0x90, 4)
+eviocrevoke = _iow('E', 0x91, 4)
+# The kernel compares the whole request, so plain write direction
+eviocsmask = _ioc(1, 'E', 0x93, 16)
+
+class AbsValues:
+	minimum = 0
+	maximum = 0
+	fuzz = 0
+	flat = 0
+	resolution = 0
+	def __init__(self, t):
+		_, self.minimum, self.maximum, self.fuzz, self.flat, self.resolution = t
+	def __repr__(self):
+		return "({}, {}, {}, {}, {})".format(self.minimum, self.maximum, self.fuzz, self.flat, self.resolution)
+
+class AbsAxis:
+	"""
+	Normalizes values of an absolute axis into -1.0 to 1.0.
+	Precomputed from the axis information, with the deadzone
+	taken from the flat and fuzz values.
+	"""
+	__slots__ = ('offset', 'scale', 'deadzone')
+
+	def __init__(self, absinfo):
+		half = (absinfo.maximum - absinfo.minimum) / 2.0
+		self.offset = absinfo.minimum + half
+		self.scale = 1.0 / half if half else 0.0
+		self.deadzone = max(absinfo.flat, absinfo.fuzz) * self.scale
+
+	def normalize(self, value):
+		value = (value - self.offset) * self.scale
+		if -self.deadzone < value < self.deadzone:
+			return 0.0
+		# According to the documentation, this is needed to be done as there
+		# are no such modification within the kernel
+		return max(-1.0, min(value, 1.0))
+
+class Bitset:
+	"""
+	Immutable set of bits, decoded from an ioctl bitmask.
+	"""
+	__slots__ = ('_mask',)
+
+	def __init__(self, mask=0):
+		self._mask = mask
+
+	@classmethod
+	def from_bytes(cls, buf):
+		return cls(int.from_bytes(buf, 'little'))
+
+	def __contains__(self, bit):
+		return bit >= 0 and (self._mask >> bit) & 1 == 1
+
+	def __iter__(self):
+		mask = self._mask
+		while mask:
+			low = mask & -mask
+			yield low.bit_length() - 1
+			mask ^= low
+
+	def __len__(self):
+		return bin(self._mask).count('1')
+
+	def __bool__(self):
+		return self._mask != 0
+
+	def __int__(self):
+		return self._mask
+
+	def __eq__(self, other):
+		return isinstance(other, Bitset) and self._mask == other._mask
+
+	def __hash__(self):
+		return hash(self._mask)
+
+	def __repr__(self):
+		return "Bitset({})".format(list(self))
+
+class DeviceCache:
+	"""
+	Remembers the probed properties and capabilities of devices.
+	Stored in memory and on disk, keyed by device identity.
+	An entry is invalid when the driver version changes.
+	"""
+	# Increase when the stored format changes
+	VERSION = 2
+
+	def __init__(self, path=None):
+		if not path:
+			cache = os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache"))
+			path = os.path.join(cache, "pi-lounge", "devices.json")
+		self._path = path
+		self._lock = threading.Lock()
+		self._devices = None
+
+	def _load(self):
+		if self._devices is not None:
+			return
+		try:
+			with open(self._path) as f:
+				data = json.load(f)
+			if data["version"] != self.VERSION:
+				raise ValueError("Old cache")
+			self._devices = {tuple(key): entry for key, entry in data["devices"]}
+		except (OSError, ValueError, TypeError, KeyError):
+			self._devices = {}
+
+	def _save(self):
+		tmp = self._path + ".tmp"
+		try:
+			os.makedirs(os.path.dirname(self._path), exist_ok=True)
+			with open(tmp, 'w') as f:
+				json.dump({
+					"version": self.VERSION,
+					"devices": [[list(key), entry] for key, entry in self._devices.items()]
+				}, f)
+			os.replace(tmp, self._path)
+		except OSError:
+			# Still usable in memory
+			pass
+
+	def get(self, key, driver):
+		with self._lock:
+			self._load()
+			entry = self._devices.get(key)
+		if not entry or entry["driver"] != driver:
+			return None
+		properties = Bitset(entry["properties"])
+		capabilities = {ev_type: Bitset(codes) for ev_type, codes in entry["capabilities"]}
+		absinfo = {code: AbsValues(values) for code, values in entry["absinfo"]}
+		return properties, entry["num_effects"], capabilities, absinfo
+
+	def put(self, key, driver, info):
+		properties, num_effects, capabilities, absinfo = info
+		entry = {
+			"driver": driver,
+			"properties": int(properties),
+			"num_effects": num_effects,
+			"capabilities": [[ev_type, int(codes)] for ev_type, codes in capabilities.items()],
+			"absinfo": [[code, [0, values.minimum, values.maximum, values.fuzz, values.flat, values.resolution]]
+				for code, values in absinfo.items()]
+		}
+		with self._lock:
+			self._load()
+			self._devices[key] = entry
+			self._save()
+
+class Reactor:
+	"""
+	Dispatches readable file descriptors from a single thread.
+	Used instead of one thread for each device and manager.
+	A failing callback is logged without stopping the others.
+	Sleeps until a file is readable or a timer is due, and is woken
+	through a pipe when closed or given an earlier timer.
+	"""
+	def __init__(self):
+		self._selector = selectors.DefaultSelector()
+		self._timers = []
+		self._timers_lock = threading.Lock()
+		self._wake_read, self._wake_write = os.pipe()
+		os.set_blocking(self._wake_read, False)
+		os.set_blocking(self._wake_write, False)
+		self._selector.register(self._wake_read, selectors.EVENT_READ, self._woken)
+		self._runner = True
+		self._thread = threading.Thread(target=self.loop, daemon=True)
+		self._thread.start()
+
+	def register(self, fileobj, callback):
+		self._selector.register(fileobj, selectors.EVENT_READ, callback)
+
+	def unregister(self, fileobj):
+		try:
+			self._selector.unregister(fileobj)
+		except (KeyError, ValueError):
+			pass
+
+	def call_later(self, delay, callback):
+		"""Calls back from the reactor thread after the delay."""
+		with self._timers_lock:
+			heapq.heappush(self._timers, (time.monotonic() + delay, id(callback), callback))
+			earliest = self._timers[0][2] is callback
+		# The loop might sleep past it
+		if earliest:
+			self._wake()
+
+	def _wake(self):
+		try:
+			os.write(self._wake_write, b'x')
+		except BlockingIOError:
+			# Already woken
+			pass
+
+	def _woken(self):
+		try:
+			while os.read(self._wake_read, 4096):
+				pass
+		except BlockingIOError:
+			pass
+
+	def _call(self, callback):
+		try:
+			callback()
+		except Exception:
+			logging.getLogger(__name__).exception("Reactor callback failed")
+
+	def loop(self):
+		while self._runner:
+			# Until the next timer, or woken
+			timeout = None
+			with self._timers_lock:
+				if self._timers:
+					timeout = max(0.0, self._timers[0][0] - time.monotonic())
+			for key, _ in self._selector.select(timeout=timeout):
+				self._call(key.data)
+			now = time.monotonic()
+			while True:
+				with self._timers_lock:
+					if not self._timers or self._timers[0][0] > now:
+						break
+					callback = heapq.heappop(self._timers)[2]
+				self._call(callback)
+
+	def close(self):
+		self._runner = False
+		self._wake()
+		self._thread.join()
+		self._selector.close()
+		os.close(self._wake_read)
+		os.close(self._wake_write)
+
 class EventHandler:
 	"""
 	Keeps track of an event.
+	Reads from its own thread, or from a reactor if given.
 	"""
-	def __init__(self, dev):
+	# Number of events read with each call
+	BATCH = 64
+	# Deliver only the latest axis values of each frame
+	coalesce = False
+	# Shared between all devices, None to always probe
+	cache = DeviceCache()
+
+	def __init__(self, dev, reactor=None):
 		self._dev = dev
-		self._fd = open(dev, 'rb')
+		# When the first input was delivered
+		self.first_event = None
+		self._probed = threading.Event()
+		self._probe_lock = threading.Lock()
+		self._cache_key = None
+		self._interest = None
+		self._filter = None
+		# Current frame, and the index of each axis within it
+		self._frame = []
+		self._frame_index = {}
+		self._axes = {}
+		self._dropped = False
+		self.raw_events = 0
+		self.delivered_events = 0
+		self._fd = open(dev, 'rb', buffering=0)
 		self._input = struct.Struct('llHHi')
-		# Start input thread
+		self._buffer = bytearray(self._input.size * self.BATCH)
+		self._view = memoryview(self._buffer)
 		self._wait = threading.Event()
 		self._wait.set()
+		self._reactor = reactor
+		if reactor:
+			self.get_info()
+			self.probe_async()
+			os.set_blocking(self._fd.fileno(), False)
+			reactor.register(self._fd, self._ready)
+			return
+		# Start input thread
 		self._runner = True
 		self._thread = threading.Thread(target=self.loop, daemon=True)
 		self._thread.start()
@@ -561,6 +871,10 @@ class EventHandler:
 		return self._dev
 
 	def close(self):
+		if self._reactor:
+			self._reactor.unregister(self._fd)
+			self._fd.close()
+			return
 		self._runner = False
 		self._wait.set()
 		self._fd.close()
@@ -576,6 +890,7 @@ class EventHandler:
 		try:
 			with self._fd:
 				self.get_info()
+				self.probe_async()
 				while self._runner:
 					self.read()
 					self._wait.wait()
@@ -583,86 +898,184 @@ class EventHandler:
 			# Disconnected
 			self._fd.close()
 
+	def _ready(self):
+		try:
+			self.read()
+		except (OSError, ValueError):
+			# Disconnected
+			self._reactor.unregister(self._fd)
+			self._fd.close()
+
 	def read(self):
-		evbuf = self._fd.read(self._input.size)
+		batch = []
+		while True:
+			# None when there is nothing more to read
+			n = self._fd.readinto(self._buffer)
+			if n == 0:
+				raise OSError("{} closed".format(self._dev))
+			if not n:
+				break
+			batch.extend(self._input.iter_unpack(self._view[:n]))
+			# Blocking reads would wait for more, and a partial read is drained
+			if not self._reactor or n < len(self._buffer):
+				break
+		self.raw_events += len(batch)
+		if self._filter:
+			interest = self._filter
+			batch = [event for event in batch if not event[2] or (event[2], event[3]) in interest]
+		if self.coalesce:
+			batch = self._coalesce(batch)
 		if not self._wait.is_set():
 			return
-		if not evbuf:
+		if not batch:
 			return
-		self.event(*self._input.unpack(evbuf))
+		self.delivered_events += len(batch)
+		if self.first_event is None:
+			self.first_event = time.monotonic()
+		self.events(batch)
+
+	def _coalesce(self, batch):
+		"""
+		Holds events until the frame is complete.
+		Absolute axes keep their latest value and relative axes
+		are summed, while other events are kept in order.
+		"""
+		delivered = []
+		frame = self._frame
+		axes = self._frame_index
+		for event in batch:
+			_, _, evtype, code, value = event
+			if evtype == EventTypes.EV_SYN:
+				if code == EventCodes.SYN_REPORT:
+					if self._dropped:
+						# State is unknown, retrieve it instead
+						self._dropped = False
+						frame.extend(self._resync(event[0], event[1]))
+					delivered.extend(frame)
+					delivered.append(event)
+					frame.clear()
+					axes.clear()
+				elif code == EventCodes.SYN_DROPPED:
+					# Events until the next report are incomplete
+					self._dropped = True
+					frame.clear()
+					axes.clear()
+				else:
+					frame.append(event)
+			elif self._dropped:
+				continue
+			elif evtype == EventTypes.EV_ABS or evtype == EventTypes.EV_REL:
+				i = axes.get((evtype, code))
+				if i is None:
+					axes[(evtype, code)] = len(frame)
+					frame.append(event)
+				elif evtype == EventTypes.EV_ABS:
+					frame[i] = event
+				else:
+					frame[i] = event[:4] + (frame[i][4] + value,)
+			else:
+				frame.append(event)
+		return delivered
+
+	def _resync(self, tv_sec, tv_usec):
+		"""
+		Current value of the absolute axes.
+		"""
+		if not self.probed:
+			return []
+		events = []
+		for code in self._absinfo:
+			if self._interest is not None and (EventTypes.EV_ABS, code) not in self._interest:
+				continue
+			absinfo = array.array('i', [0] * 6)
+			try:
+				ioctl(self._fd, eviocgabs(code), absinfo)
+			except OSError:
+				continue
+			events.append((tv_sec, tv_usec, EventTypes.EV_ABS, code, absinfo[0]))
+		return events
+
+	def events(self, batch):
+		for event in batch:
+			self.event(*event)
 
 	def event(self, tv_sec, tv_usec, evtype, code, value):
 		pass
 
+	def set_interest(self, interest):
+		"""
+		Only deliver the given (type, code) pairs and synchronization.
+		Filtered by the kernel when supported, otherwise when read.
+		"""
+		self._interest = frozenset(interest)
+		types = {EventTypes.EV_SYN}
+		codes = {}
+		for evtype, code in interest:
+			types.add(evtype)
+			codes.setdefault(evtype, set()).add(code)
+		try:
+			self._set_mask(0, types)
+			for evtype, bits in codes.items():
+				self._set_mask(evtype, bits)
+		except OSError:
+			self._filter = self._interest
+		else:
+			self._filter = None
+
+	def _set_mask(self, evtype, bits):
+		size = EventCodes.KEY_MAX // 8 + 1
+		buf = array.array('B', sum(1 << bit for bit in bits).to_bytes(size, 'little'))
+		ioctl(self._fd, eviocsmask, struct.pack('IIQ', evtype, size, buf.buffer_info()[0]))
+
 	def is_connected(self):
+		if self._reactor:
+			return not self._fd.closed
 		return self._thread.is_alive()
 
+	@property
+	def probed(self):
+		return self._probed.is_set()
+
+	@property
+	def properties(self):
+		self.probe()
+		return self._properties
+
+	@property
+	def num_effects(self):
+		self.probe()
+		return self._num_effects
+
+	@property
+	def capabilities(self):
+		self.probe()
+		return self._capabilities
+
+	@property
+	def absinfo(self):
+		self.probe()
+		return self._absinfo
+
+	@property
+	def axes(self):
+		self.probe()
+		return self._axes
+
 	def get_info(self):
 		"""
-		Retrieves the information and stores it within the object.
+		Retrieves the identity and stores it within the object.
 		Normally should only be called once.
-		Left out for performance reasons.
+		Capabilities of known devices are retrieved from the cache,
+		otherwise they are probed on first access.
 		"""
-		### ioctl ###
-		# Note: For Raspberry Pi, this is how it works
-		# From kernel <uapi/linux/ioctl.h>
-		_ioc_nrbits = 8
-		_ioc_typebits = 8
-		_ioc_sizebits = 14 # 13 in source, but libraries uses this one
-		_ioc_dirbits = 2 # 3 in source, but libraries...
-
-		_ioc_nrshift = 0
-		_ioc_typeshift = _ioc_nrshift+_ioc_nrbits
-		_ioc_sizeshift = _ioc_typeshift+_ioc_typebits
-		_ioc_dirshift = _ioc_sizeshift+_ioc_sizebits
-
-		# Other libraries starts at 0
-		_ioc_none = 1
-		_ioc_read = 2
-		_ioc_write = 3
-
-		_ioc = lambda dir, type, nr, size: (
-			(dir << _ioc_dirshift) |
-			(ord(type) << _ioc_typeshift) |
-			(nr << _ioc_nrshift) |
-			(size << _ioc_sizeshift))
-		_ior = lambda type, nr, size: _ioc(_ioc_read, type, nr, size)
-		_iow = lambda type, nr, size: _ioc(_ioc_write, type, nr, size)
-
-		eviocgversion = _ior('E', 0x01, 4)
-		eviocgid = _ior('E', 0x02, 8)
-		eviocgrep = _ior('E', 0x03, 8)
-		eviocsrep = _iow('E', 0x04, 8)
-		eviocgname = lambda len: _ioc(_ioc_read, 'E', 0x06, len)
-		eviocgphys = lambda len: _ioc(_ioc_read, 'E', 0x07, len)
-		eviocguniq = lambda len: _ioc(_ioc_read, 'E', 0x08, len)
-		eviocgprop = lambda len: _ioc(_ioc_read, 'E', 0x09, len)
-		eviocgbit = lambda ev, len: _ioc(_ioc_read, 'E', 0x20 + (ev), len)
-		eviocgabs = lambda abs: _ior('E', 0x40 + abs, 48)
-		eviocsff = _iow('E', 0x80, 38)
-		eviocrmff = _iow('E', 0x81, 4)
-		eviocgeffects = _ior('E', 0x84, 4)
-		eviocgrab = _iow('E', 0x90, 4)
-		eviocrevoke = _iow('E', 0x91, 4)
-
-		test_bit = lambda bitmask, bit: bitmask[bit//8] & (1 << (bit % 8))
-		class AbsValues:
-			minimum = 0
-			maximum = 0
-			fuzz = 0
-			flat = 0
-			resolution = 0
-			def __init__(self, t):
-				_, self.minimum, self.maximum, self.fuzz, self.flat, self.resolution = t
-			def __repr__(self):
-				return "({}, {}, {}, {}, {})".format(self.minimum, self.maximum, self.fuzz, self.flat, self.resolution)
-
 		### Device info ###
 
 		buf = array.array('H', [0] * 4)
+		identified = False
 		try:
 			ioctl(self._fd, eviocgid, buf)
 			self.bustype, self.vendor, self.product, self.version = buf
+			identified = True
 		except:
 			self.bustype = 0
 			self.vendor = 0
@@ -693,66 +1106,101 @@ class EventHandler:
 		except:
 			self.driver = 0
 
+		### Cache ###
+
+		# Only devices that could identify themselves
+		cache = self.cache if identified else None
+		key = (self.bustype, self.vendor, self.product, self.version, self.name, self.uniq)
+		self._cache_key = key if cache else None
+		info = cache.get(key, self.driver) if cache else None
+		if info:
+			with self._probe_lock:
+				self._properties, self._num_effects, self._capabilities, self._absinfo = info
+				self._loaded()
+
+	def probe(self):
+		"""
+		Retrieves properties and capabilities, unless already known.
+		"""
+		if self._probed.is_set():
+			return
+		with self._probe_lock:
+			if self._probed.is_set():
+				return
+			self._probe()
+			if self._cache_key:
+				info = (self._properties, self._num_effects, self._capabilities, self._absinfo)
+				self.cache.put(self._cache_key, self.driver, info)
+			self._loaded()
+
+	def _loaded(self):
+		self._axes = {code: AbsAxis(values) for code, values in self._absinfo.items()}
+		self._effects()
+		self._probed.set()
+
+	def probe_async(self):
+		"""
+		Probes in the background, as input is already delivered.
+		"""
+		if not self._probed.is_set():
+			threading.Thread(target=self.probe, daemon=True).start()
+
+	def _probe(self):
+		"""
+		Retrieves properties and capabilities from the device.
+		Capabilities are stored as bitsets of codes for each type,
+		with the absolute axes information stored separately.
+		"""
 		### Properties ###
 
 		input_prop_max = 0x1f
 		count = (input_prop_max+7)//8
-		buf = array.array('B', [0] * count)
-		self.properties = []
+		buf = bytearray(count)
 		try:
 			ioctl(self._fd, eviocgprop(count), buf)
 		except:
 			pass
-		else:
-			for i in range(input_prop_max):
-				if test_bit(buf, i):
-					self.properties.append(i)
+		self._properties = Bitset.from_bytes(buf)
 		buf = array.array('i', [0])
 		try:
 			ioctl(self._fd, eviocgeffects, buf)
-			self.num_effects = buf[0]
+			self._num_effects = buf[0]
 		except:
-			self.num_effects = 0
+			self._num_effects = 0
 
 		### Capabilities ###
 
 		ev_size = EventTypes.EV_MAX // 8 + 1
 		key_size = EventCodes.KEY_MAX // 8 + 1
-		ev_bits = array.array('B', [0] * ev_size)
-		self.capabilities = {}
+		ev_bits = bytearray(ev_size)
+		self._capabilities = {}
+		self._absinfo = {}
 		try:
 			ioctl(self._fd, eviocgbit(0, ev_size), ev_bits)
 		except:
 			pass
 		else:
-			for ev_type in range(EventTypes.EV_MAX):
-				if not test_bit(ev_bits, ev_type):
-					continue
-				capability = ev_type
-				eventcodes = {}
-				code_bits = array.array('B', [0] * key_size)
+			for ev_type in Bitset.from_bytes(ev_bits):
+				code_bits = bytearray(key_size)
 				try:
 					ioctl(self._fd, eviocgbit(ev_type, key_size), code_bits)
 				except:
 					continue
-				for ev_code in range(EventCodes.KEY_MAX):
-					if not test_bit(code_bits, ev_code):
-						continue
-					if ev_type == EventTypes.EV_ABS:
+				codes = Bitset.from_bytes(code_bits)
+				if ev_type == EventTypes.EV_ABS:
+					for ev_code in codes:
 						absinfo = array.array('i', [0] * 6)
 						try:
 							ioctl(self._fd, eviocgabs(ev_code), absinfo)
-							absinfo = AbsValues(absinfo)
 						except:
 							continue
-						eventcodes[ev_code] = absinfo
-					else:
-						eventcodes[ev_code] = True
-				self.capabilities[capability] = eventcodes
+						self._absinfo[ev_code] = AbsValues(absinfo)
+				self._capabilities[ev_type] = codes
 
+	def _effects(self):
 		### Effects ###
 
-		if EventTypes.EV_FF in self.capabilities:
+		if EventTypes.EV_FF in self._capabilities:
 			# https://www.kernel.org/doc/html/v4.14/input/ff.html
 			def upload_effect(etype, eid, direction, trigger, replay, effect):
 				if etype not in self.capabilities[EventTypes.EV_FF]:
@@ -842,15 +1290,33 @@ class EventHandler:
 class EventManager:
 	"""
 	Keeps track of events.
+	Watches from its own thread, or from a reactor if given.
+	The interest is a set of (type, code) pairs that devices deliver.
+	Coalescing delivers only the latest axis values of each frame.
 	"""
-	def __init__(self, create_event):
+	# Attempts to open a new device, 0.1s apart
+	RETRIES = 50
+
+	def __init__(self, create_event, reactor=None, interest=None, coalesce=False):
 		self._create_event = create_event
+		self.interest = interest
+		self.coalesce = coalesce
+		# When each device was plugged in, or first seen
+		self._plugged = {}
 		self._devices = self.get_all()
 		# Watchers
 		self._inotify = INotify()
 		self._wd = self._inotify.add_watch(self.get_path(), flags.CREATE | flags.ATTRIB | flags.DELETE)
+		self._created = []
+		# New devices that could not be opened yet, with retries left
+		self._pending = {}
+		self._retrying = False
 		self._wait = threading.Event()
 		self._wait.set()
+		self._reactor = reactor
+		if reactor:
+			reactor.register(self._inotify, self._ready)
+			return
 		self._runner = True
 		self._thread = threading.Thread(target=self._loop, daemon=True)
 		self._thread.start()
@@ -859,6 +1325,23 @@ class EventManager:
 	def devices(self):
 		return self._devices
 
+	def stats(self):
+		"""
+		Events read from and delivered by all devices.
+		"""
+		raw = sum(device.raw_events for device in self._devices)
+		delivered = sum(device.delivered_events for device in self._devices)
+		return raw, delivered
+
+	def latencies(self):
+		"""
+		Hotplug to first event for devices that have delivered input,
+		including the time waiting for permissions.
+		"""
+		plugged = dict(self._plugged)
+		return {device.dev: device.first_event - plugged[device.dev] for device in self._devices
+			if device.first_event is not None and device.dev in plugged}
+
 	def is_device(self, dev):
 		return dev.startswith("event") or "-event-" in dev
 
@@ -866,31 +1349,68 @@ class EventManager:
 		return "/dev/input"
 
 	def _loop(self):
-		import time
 		while self._runner:
-			create = []
-			for event in self._inotify.read(timeout=100, read_delay=10):
-				if not self._wait.is_set():
-					break
-				if not self.is_device(event.name):
-					continue
-				if event.mask & flags.CREATE:
-					create.append(event.name)
-				if event.mask & flags.ATTRIB and event.name in create:
-					create.remove(event.name)
-					# Retry until success
-					while True:
-						try:
-							with open("{}/{}".format(self.get_path(), event.name), 'rb'):
-								break
-						except:
-							time.sleep(0.1)
-					self.update_state()
-				if event.mask & flags.DELETE:
-					self.update_state()
+			self._handle(self._inotify.read(timeout=100, read_delay=10))
+			self._retry()
 			self._wait.wait()
 
+	def _ready(self):
+		events = self._inotify.read(timeout=0)
+		if self._wait.is_set():
+			self._handle(events)
+
+	def _handle(self, events):
+		for event in events:
+			if not self._wait.is_set():
+				break
+			if not self.is_device(event.name):
+				continue
+			dev = "{}/{}".format(self.get_path(), event.name)
+			if event.mask & flags.CREATE:
+				self._created.append(event.name)
+				self._plugged[dev] = time.monotonic()
+			if event.mask & flags.ATTRIB and (event.name in self._created or event.name in self._pending):
+				if event.name in self._created:
+					self._created.remove(event.name)
+				# Permissions might not be set yet
+				self._pending[event.name] = self.RETRIES
+			if event.mask & flags.DELETE:
+				self._pending.pop(event.name, None)
+				self._plugged.pop(dev, None)
+				self.update_state()
+		if self._pending and self._reactor and not self._retrying:
+			self._retrying = True
+			self._reactor.call_later(0, self._retry)
+
+	def _retry(self):
+		"""
+		Adds the new devices that can be opened, while the others
+		are retried later without blocking.
+		"""
+		self._retrying = False
+		if not self._pending or not self._wait.is_set():
+			return
+		opened = False
+		for name, retries in list(self._pending.items()):
+			if self.is_valid_dev("{}/{}".format(self.get_path(), name)):
+				del self._pending[name]
+				opened = True
+			elif retries > 1:
+				self._pending[name] = retries - 1
+			else:
+				# Until permissions change again
+				del self._pending[name]
+		if opened:
+			self.update_state()
+		if self._pending and self._reactor:
+			self._retrying = True
+			self._reactor.call_later(0.1, self._retry)
+
 	def close(self):
+		if self._reactor:
+			self._reactor.unregister(self._inotify)
+			self._inotify.rm_watch(self._wd)
+			return
 		self._runner = False
 		self._wait.set()
 		self._inotify.rm_watch(self._wd)
@@ -918,8 +1438,16 @@ class EventManager:
 	def cur_devs(self):
 		return ['{}/{}'.format(self.get_path(), fn) for fn in os.listdir(self.get_path()) if self.is_device(fn)]
 
+	def _create(self, dev):
+		self._plugged.setdefault(dev, time.monotonic())
+		device = self._create_event(dev)
+		device.coalesce = self.coalesce
+		if self.interest is not None:
+			device.set_interest(self.interest)
+		return device
+
 	def get_all(self):
-		return [self._create_event(dev) for dev in self.cur_devs()]
+		return [self._create(dev) for dev in self.cur_devs()]
 
 	def update_state(self):
 		rem_devices = [device for device in self._devices if not device.is_connected()]
@@ -928,16 +1456,23 @@ class EventManager:
 		cur_devs = self.cur_devs()
 		old_devs = [device.dev for device in self._devices]
 		new_devs = [dev for dev in cur_devs if dev not in old_devs]
-		self._devices.extend([self._create_event(dev) for dev in new_devs if self.is_valid_dev(dev)])
+		self._devices.extend([self._create(dev) for dev in new_devs if self.is_valid_dev(dev)])
 		return self.devices
 
 class GeneralEvent(EventHandler):
 	"""
 	General event handler.
 	"""
-	def __init__(self, dev, callback):
+	def __init__(self, dev, callback, reactor=None, batch_callback=None):
 		self.callback = callback
-		super().__init__(dev)
+		self.batch_callback = batch_callback
+		super().__init__(dev, reactor)
+
+	def events(self, batch):
+		if self.batch_callback:
+			self.batch_callback(self, batch)
+		else:
+			super().events(batch)
 
 	def event(self, tv_sec, tv_usec, evtype, code, value):
 		self.callback(self, evtype, code, value)
@@ -945,9 +1480,10 @@ class GeneralEvent(EventHandler):
 class GeneralEventManager(EventManager):
 	"""
 	General event manager.
+	The batch callback receives all events read at once.
 	"""
-	def __init__(self, callback):
-		super().__init__(lambda dev: GeneralEvent(dev, callback))
+	def __init__(self, callback, reactor=None, batch_callback=None, interest=None, coalesce=False):
+		super().__init__(lambda dev: GeneralEvent(dev, callback, reactor, batch_callback), reactor, interest, coalesce)
 
 
 class DebugEvent(GeneralEvent):
@@ -976,5 +1512,6 @@ if __name__ == "__main__":
 			print("{}, {}, {}, {}".format(hex(event.bustype), hex(event.vendor), hex(event.product), hex(event.version)))
 			print("{}, {}, {}, {}".format(event.name, event.phys, event.uniq, event.driver))
 			print(event.capabilities)
+			print(event.absinfo)
 			print(event.properties)
 
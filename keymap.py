@@ -0,0 +1,103 @@
+import os
+import json
+import logging
+
+from .event import EventTypes, EventCodes
+from .remote import KeyCodes as RemoteCodes
+
+class Keymap:
+	"""
+	Bindings from input events to actions.
+	Compiled into a table keyed by (source, type, code).
+	"""
+	EVENT = "event"
+	REMOTE = "remote"
+	# Actions and the names of the codes bound to them
+	DEFAULT = {
+		EVENT: {
+			"enter": ["BTN_A", "KEY_ENTER", "BTN_LEFT"],
+			"back": ["BTN_B", "KEY_ESC", "BTN_RIGHT"],
+			"up": ["KEY_UP"],
+			"down": ["KEY_DOWN"],
+			"direction": ["REL_WHEEL", "ABS_HAT0Y"],
+			"axis": ["ABS_Y", "ABS_RZ"]
+		},
+		REMOTE: {
+			"enter": ["KEY_OK"],
+			"back": ["KEY_BACK"],
+			"up": ["KEY_UP"],
+			"down": ["KEY_DOWN"]
+		}
+	}
+	ACTIONS = frozenset(action for actions in DEFAULT.values() for action in actions)
+
+	def __init__(self, bindings=None):
+		self.bindings = bindings if bindings else self.DEFAULT
+		self.table = self.compile()
+
+	@classmethod
+	def load(cls, path=None):
+		"""
+		Loads bindings from a JSON file, which replace the default
+		bindings of the actions that it contains. A broken file is
+		logged and the default bindings are used instead.
+		"""
+		if not path:
+			config = os.environ.get("XDG_CONFIG_HOME", os.path.expanduser("~/.config"))
+			path = os.path.join(config, "pi-lounge", "keymap.json")
+		bindings = {source: dict(actions) for source, actions in cls.DEFAULT.items()}
+		try:
+			with open(path) as f:
+				data = json.load(f)
+			if not isinstance(data, dict) or not all(isinstance(actions, dict) for actions in data.values()):
+				raise ValueError("Expected actions by source")
+			for source, actions in data.items():
+				bindings.setdefault(source, {}).update(actions)
+			return cls(bindings)
+		except FileNotFoundError:
+			return cls()
+		except (ValueError, OSError) as e:
+			logging.getLogger(__name__).error("Ignoring keymap %s: %s", path, e)
+			return cls()
+
+	def compile(self):
+		table = {}
+		for source, actions in self.bindings.items():
+			for action, names in actions.items():
+				if action not in self.ACTIONS:
+					raise ValueError("Unknown action {}".format(action))
+				if not isinstance(names, list) or not all(isinstance(name, str) for name in names):
+					raise ValueError("Expected a list of codes for {}".format(action))
+				for name in names:
+					table[(source, *self.resolve(source, name))] = action
+		return table
+
+	def interest(self):
+		"""
+		All (type, code) pairs bound for events.
+		"""
+		return frozenset((evtype, code) for source, evtype, code in self.table if source == self.EVENT)
+
+	@classmethod
+	def resolve(cls, source, name):
+		"""
+		Type and code of a named code.
+		"""
+		if source == cls.REMOTE:
+			codes = RemoteCodes
+			evtype = 0
+		elif source == cls.EVENT:
+			codes = EventCodes
+			if name.startswith("KEY_") or name.startswith("BTN_"):
+				evtype = EventTypes.EV_KEY
+			elif name.startswith("REL_"):
+				evtype = EventTypes.EV_REL
+			elif name.startswith("ABS_"):
+				evtype = EventTypes.EV_ABS
+			else:
+				raise ValueError("Unknown type of code {}".format(name))
+		else:
+			raise ValueError("Unknown source {}".format(source))
+		if not hasattr(codes, name):
+			raise ValueError("Unknown code {}".format(name))
+		return evtype, getattr(codes, name)
@@ -1,98 +1,240 @@
 
 import threading
-import curses
+import time
+from collections import deque
+
+from .render import Renderer, CursesRenderer
+
+def locked(func):
+	"""Holds the lock of the menu, as it is drawn from another thread."""
+	def f(self, *args, **kwargs):
+		with self.parent.lock:
+			return func(self, *args, **kwargs)
+	return f
 
 class Menu:
 	"""
 	Keep track of the menu.
+	The screen is owned by a render thread, which draws the
+	active sub menu when invalidated, at most fps times a second.
 	"""
-	def __init__(self):
+	def __init__(self, fps=30, renderer=None):
 		self.menu = {}
 		self.curr = 0
+		self.fps = fps
+		self.renderer = renderer if renderer else CursesRenderer()
+		# Sub menu currently on screen
+		self.drawn = None
+		# Sub menu to draw
+		self.active = None
+		self.lock = threading.RLock()
+		self.runner = False
+		self._paused = False
+		self._invalid = threading.Event()
+		# Set once the first frame has been drawn
+		self.visible = threading.Event()
+		# Duration of the latest frames
+		self.frame_times = deque(maxlen=100)
+		# Called after the next frame
+		self._after = []
 
 	def __enter__(self):
-		self.screen = curses.initscr()
-		# Create colors
-		curses.start_color()
-		curses.init_pair(1, curses.COLOR_GREEN, curses.COLOR_BLACK)
-		curses.init_pair(2, curses.COLOR_BLACK, curses.COLOR_GREEN)
-		self.start()
-		self.screen.keypad(True)
+		self.renderer.open()
+		self.runner = True
+		self._thread = threading.Thread(target=self._render, daemon=True)
+		self._thread.start()
 
 	def __exit__(self, exc_type, exc_val, exc_tb):
 		self.runner = False
-		self.stop()
-		self.screen.keypad(0)
-		curses.endwin()
+		self._invalid.set()
+		self._thread.join()
+		self.renderer.close()
+
+	def _render(self):
+		while self.runner:
+			self._invalid.wait()
+			self._invalid.clear()
+			start = time.monotonic()
+			with self.lock:
+				# Later requests wait for the frame after this one
+				after, self._after = self._after, []
+				if self.active and not self._paused and self.runner:
+					self.active.paint()
+					self.visible.set()
+			end = time.monotonic()
+			self.frame_times.append(end - start)
+			for callback in after:
+				callback(end)
+			# Cap the frame rate, later requests are drawn together
+			time.sleep(max(0.0, 1.0 / self.fps - (end - start)))
+
+	def show(self, sub):
+		"""Makes the sub menu the one drawn."""
+		with self.lock:
+			self.active = sub
+		self._invalid.set()
+
+	def invalidate(self, sub=None):
+		"""Requests a redraw from any thread."""
+		if sub is None or sub is self.active:
+			self._invalid.set()
+
+	def after_frame(self, callback):
+		"""Calls back with the end time of the next frame drawn."""
+		with self.lock:
+			self._after.append(callback)
+		self._invalid.set()
+
+	def frame_stats(self):
+		"""Number, average and worst duration of the latest frames."""
+		times = list(self.frame_times)
+		if not times:
+			return 0, 0.0, 0.0
+		return len(times), sum(times) / len(times), max(times)
 
 	def start(self):
-		# Remove odd behavior
-		self.screen.refresh()
-		# Set flags
-		curses.noecho()
-		curses.cbreak()
-		curses.curs_set(0)
+		self.renderer.start()
 
 	def stop(self):
-		curses.curs_set(1)
-		curses.nocbreak()
-		curses.echo()
+		self.renderer.stop()
 
 	def sub_menu(self):
 		return SubMenu(self)
 
 	def pause(self):
-		self.stop()
+		with self.lock:
+			self._paused = True
+			self.stop()
 
 	def resume(self):
-		self.start()
-		self.screen.clear()
-		self.screen.refresh()
+		with self.lock:
+			self.start()
+			self.renderer.clear()
+			self.drawn = None
+			self._paused = False
+		self._invalid.set()
+
+class MenuItem:
+	"""
+	A row in a sub menu, optionally with a stable id.
+	"""
+	__slots__ = ('key', 'text', 'fn', 'id')
+
+	def __init__(self, key, text, fn, id=None):
+		self.key = key
+		self.text = text
+		self.fn = fn
+		self.id = id
 
 class SubMenu:
+	"""
+	Keeps track of the rows that needs to be redrawn.
+	Only the rows that fit on the screen are drawn, scrolled
+	to keep the current row visible.
+	"""
 	def __init__(self, parent):
 		self.menu = []
 		self.curr = 0
+		self.top = 0
 		self.parent = parent
+		# Index of each item by id
+		self._index = {}
+		self._dirty = set()
+		self._full = True
 
 	def get_parent(self):
 		return self.parent
 
-	def add(self, key, text, fn, default=False):
+	@locked
+	def add(self, key, text, fn, default=False, id=None):
 		if default:
+			self._dirty.add(self.curr)
 			self.curr = len(self.menu)
-		self.menu.append({
-			"key": key,
-			"text": text,
-			"fn": fn
-		})
+		if id is not None:
+			self._index[id] = len(self.menu)
+		self._dirty.add(len(self.menu))
+		self.menu.append(MenuItem(key, text, fn, id))
 
+	@locked
 	def update(self, i=None, key=None, text=None, fn=None):
 		if key == None and text == None and fn == None:
 			return
 		if i == None or i < 0 or i >= len(self.menu):
 			i = self.curr
 		item = self.menu[i]
+		if (key and key != item.key) or (text and text != item.text):
+			self._dirty.add(i)
 		if key:
-			item["key"] = key
+			item.key = key
 		if text:
-			item["text"] = text
+			item.text = text
 		if fn:
-			item["fn"] = fn
+			item.fn = fn
+
+	def find(self, id):
+		return self._index.get(id)
+
+	@locked
+	def upsert(self, id, key=None, text=None, fn=None):
+		"""Updates the item with the id, or adds it."""
+		i = self._index.get(id)
+		if i is None:
+			self.add(key, text, fn, id=id)
+			return len(self.menu) - 1
+		self.update(i, key, text, fn)
+		return i
+
+	@locked
+	def remove(self, id):
+		"""Removes the item with the id, keeping the current item."""
+		i = self._index.pop(id, None)
+		if i is None:
+			return
+		del self.menu[i]
+		# Following rows moved up, and the last row is now empty
+		for j in range(i, len(self.menu)):
+			if self.menu[j].id is not None:
+				self._index[self.menu[j].id] = j
+		self._dirty.update(range(i, len(self.menu) + 1))
+		if self.curr > i or self.curr >= len(self.menu):
+			self.curr = max(0, self.curr - 1)
+
+	@locked
+	def sort(self, key, start=0):
+		"""Sorts the items from start, keeping the current item."""
+		curr = self.menu[self.curr] if self.menu else None
+		self.menu[start:] = sorted(self.menu[start:], key=key)
+		self._index = {item.id: i for i, item in enumerate(self.menu) if item.id is not None}
+		if curr:
+			self.curr = self.menu.index(curr)
+		self.invalidate()
 
+	@locked
 	def clear(self):
 		self.menu = []
+		self._index = {}
 		self.curr = 0
+		self.top = 0
+		self.invalidate()
+
+	def invalidate(self):
+		"""Redraw everything next time."""
+		self._full = True
 
 	def execute(self, fn=None):
-		self.parent.screen.clear()
-		self.parent.screen.refresh()
-		(fn if fn else self.menu[self.curr]["fn"])()
-		self.parent.screen.clear()
+		with self.parent.lock:
+			self.parent.renderer.clear()
+			self.parent.drawn = None
+			fn = fn if fn else self.menu[self.curr].fn
+		fn()
+		self.invalidate()
 
+	@locked
 	def jump(self, dir):
+		self._dirty.add(self.curr)
 		self.curr += dir
 		self.curr = (self.curr + len(self.menu)) % len(self.menu)
+		self._dirty.add(self.curr)
 
 	def next(self):
 		self.jump(1)
@@ -100,13 +242,55 @@ class SubMenu:
 	def prev(self):
 		self.jump(-1)
 
+	def scroll(self, height):
+		"""Moves the view to contain the current row."""
+		top = self.top
+		if self.curr < top:
+			top = self.curr
+		elif self.curr >= top + height:
+			top = self.curr - height + 1
+		top = max(0, min(top, len(self.menu) - height))
+		if top != self.top:
+			self.top = top
+			self.invalidate()
+
+	def show(self):
+		self.parent.show(self)
+
 	def draw(self):
-		curses.curs_set(1) # Enable
-		curses.curs_set(0) # Disable
-		for i, item in enumerate(self.menu):
-			key = item["key"]
-			clr = 2 if i == self.curr else 1
-			self.parent.screen.addstr(i, 0, "{}".format(key), curses.color_pair(clr))
-			if item['text']:
-				self.parent.screen.addstr(i, len(key), ": {}\n".format(item["text"]))
-		self.parent.screen.refresh()
+		"""Requests a redraw, done by the render thread."""
+		self.parent.invalidate(self)
+
+	def paint(self):
+		renderer = self.parent.renderer
+		height, width = renderer.size()
+		self.scroll(height)
+		bottom = min(len(self.menu), self.top + height)
+		if self._full or self.parent.drawn is not self:
+			renderer.erase()
+			rows = range(self.top, bottom)
+		else:
+			# Includes rows left empty after removal
+			rows = sorted(i for i in self._dirty if self.top <= i < self.top + height)
+		for i in rows:
+			if i < len(self.menu):
+				self._paint_row(renderer, i, width)
+			else:
+				renderer.clear_line(i - self.top, 0)
+		self._dirty.clear()
+		self._full = False
+		self.parent.drawn = self
+		renderer.flush()
+
+	def _paint_row(self, renderer, i, width):
+		item = self.menu[i]
+		y = i - self.top
+		# Writing the last column fails on the last line
+		line = "{}".format(item.key)[:width - 1]
+		style = Renderer.SELECTED if i == self.curr else Renderer.KEY
+		renderer.write(y, 0, line, style)
+		if item.text and len(line) < width - 1:
+			text = ": {}".format(item.text)[:width - 1 - len(line)]
+			renderer.write(y, len(line), text)
+			line += text
+		renderer.clear_line(y, len(line))
@@ -54,12 +54,25 @@ class KeyCodes:
 	KEY_GREEN = 115
 	KEY_YELLOW = 116
 
+# Commands sent when the TV is turned on or switches to us
+class OpCodes:
+	IMAGE_VIEW_ON = 0x04
+	TEXT_VIEW_ON = 0x0d
+	ROUTING_CHANGE = 0x80
+	ACTIVE_SOURCE = 0x82
+	SET_STREAM_PATH = 0x86
+	REPORT_POWER_STATUS = 0x90
+
+POWER_ON = 0x00
+
 class Remote:
 	"""
 	Handle remote via CEC from HDMI.
+	The wake callback is called when the TV is turned on.
 	"""
-	def __init__(self, callback):
+	def __init__(self, callback, wake=None):
 		self.callback = callback
+		self.wake = wake
 		self.__pause = False
 		# Put in a thread to reduce boot time.
 		# It takes time for the user to react anyway.
@@ -67,6 +80,7 @@ class Remote:
 		def init():
 			cec.init()
 			cec.add_callback(self.keypress, cec.EVENT_KEYPRESS)
+			cec.add_callback(self.command, cec.EVENT_COMMAND)
 		threading.Thread(target=init).start()
 
 	def pause(self):
@@ -82,8 +96,15 @@ class Remote:
 	def log(self, event, level, time, msg):
 		pass
 
-	def command(self, event, cmd_event, cmd):
-		pass
+	def command(self, event, cmd):
+		opcode = cmd.get("opcode")
+		parameters = cmd.get("parameters", b"")
+		if opcode == OpCodes.REPORT_POWER_STATUS:
+			woke = parameters[:1] == bytes([POWER_ON])
+		else:
+			woke = opcode in (OpCodes.IMAGE_VIEW_ON, OpCodes.TEXT_VIEW_ON, OpCodes.ROUTING_CHANGE, OpCodes.ACTIVE_SOURCE, OpCodes.SET_STREAM_PATH)
+		if woke and self.wake:
+			self.wake()
 
 	@require(cec)
 	def is_on(self):
@@ -0,0 +1,198 @@
+import sys
+import shutil
+import curses
+from collections import Counter
+try:
+	import termios
+	import tty
+except ImportError:
+	termios = None
+
+class Renderer:
+	"""
+	Draws text on the screen for the menu.
+	Nothing is shown until flushed.
+	"""
+	NORMAL = 0
+	KEY = 1
+	SELECTED = 2
+
+	def open(self):
+		pass
+
+	def close(self):
+		pass
+
+	def start(self):
+		"""Takes over the terminal."""
+		pass
+
+	def stop(self):
+		"""Gives back the terminal."""
+		pass
+
+	def size(self):
+		return 24, 80
+
+	def clear(self):
+		"""Clears the terminal right away."""
+		pass
+
+	def erase(self):
+		pass
+
+	def write(self, y, x, text, style=NORMAL):
+		pass
+
+	def clear_line(self, y, x):
+		pass
+
+	def flush(self):
+		pass
+
+class CursesRenderer(Renderer):
+	"""
+	Draws with curses, which only sends what changed.
+	"""
+	def open(self):
+		self.screen = curses.initscr()
+		# Create colors
+		curses.start_color()
+		curses.init_pair(self.KEY, curses.COLOR_GREEN, curses.COLOR_BLACK)
+		curses.init_pair(self.SELECTED, curses.COLOR_BLACK, curses.COLOR_GREEN)
+		self.start()
+		self.screen.keypad(True)
+
+	def close(self):
+		self.stop()
+		self.screen.keypad(0)
+		curses.endwin()
+
+	def start(self):
+		# Remove odd behavior
+		self.screen.refresh()
+		# Set flags
+		curses.noecho()
+		curses.cbreak()
+		curses.curs_set(0)
+
+	def stop(self):
+		curses.curs_set(1)
+		curses.nocbreak()
+		curses.echo()
+
+	def size(self):
+		return self.screen.getmaxyx()
+
+	def clear(self):
+		self.screen.clear()
+		self.screen.refresh()
+
+	def erase(self):
+		self.screen.erase()
+
+	def write(self, y, x, text, style=Renderer.NORMAL):
+		self.screen.addstr(y, x, text, curses.color_pair(style))
+
+	def clear_line(self, y, x):
+		self.screen.move(y, x)
+		self.screen.clrtoeol()
+
+	def flush(self):
+		self.screen.noutrefresh()
+		curses.doupdate()
+
+class AnsiRenderer(Renderer):
+	"""
+	Draws with plain escape sequences, without keeping a copy
+	of the screen. Lighter than curses on slow machines.
+	"""
+	STYLES = {
+		Renderer.NORMAL: "\x1b[0m",
+		Renderer.KEY: "\x1b[32;40m",
+		Renderer.SELECTED: "\x1b[30;42m"
+	}
+
+	def __init__(self, out=None):
+		self._out = out if out else sys.stdout
+		self._buf = []
+		self._attrs = None
+
+	def open(self):
+		self.start()
+
+	def close(self):
+		self.stop()
+
+	def start(self):
+		if termios and self._out.isatty():
+			fd = self._out.fileno()
+			self._attrs = termios.tcgetattr(fd)
+			tty.setcbreak(fd)
+		# Hide cursor
+		self._out.write("\x1b[?25l")
+		self.clear()
+
+	def stop(self):
+		if self._attrs:
+			termios.tcsetattr(self._out.fileno(), termios.TCSADRAIN, self._attrs)
+			self._attrs = None
+		# Show cursor
+		self._out.write("\x1b[0m\x1b[?25h")
+		self._out.flush()
+
+	def size(self):
+		size = shutil.get_terminal_size()
+		return size.lines, size.columns
+
+	def clear(self):
+		self._buf.clear()
+		self._out.write("\x1b[0m\x1b[2J\x1b[H")
+		self._out.flush()
+
+	def erase(self):
+		self._buf.append("\x1b[0m\x1b[2J")
+
+	def write(self, y, x, text, style=Renderer.NORMAL):
+		self._buf.append("\x1b[{};{}H{}{}\x1b[0m".format(y + 1, x + 1, self.STYLES[style], text))
+
+	def clear_line(self, y, x):
+		self._buf.append("\x1b[{};{}H\x1b[K".format(y + 1, x + 1))
+
+	def flush(self):
+		self._out.write("".join(self._buf))
+		self._out.flush()
+		self._buf.clear()
+
+class RecordingRenderer(Renderer):
+	"""
+	Draws nothing, but counts the calls and text written.
+	Used to measure the menu without a terminal.
+	"""
+	def __init__(self, lines=24, columns=80):
+		self._size = (lines, columns)
+		self.calls = Counter()
+		self.bytes = 0
+
+	def size(self):
+		return self._size
+
+	def clear(self):
+		self.calls["clear"] += 1
+
+	def erase(self):
+		self.calls["erase"] += 1
+
+	def write(self, y, x, text, style=Renderer.NORMAL):
+		self.calls["write"] += 1
+		self.bytes += len(text.encode('utf-8'))
+
+	def clear_line(self, y, x):
+		self.calls["clear_line"] += 1
+
+	def flush(self):
+		self.calls["flush"] += 1
+
+	def reset(self):
+		self.calls.clear()
+		self.bytes = 0
@@ -13,8 +13,10 @@ class Storage:
 	- Open up VPN if the mount does not exist.
 	- Various other nifty behaviors.
 	"""
-	def __init__(self):
+	def __init__(self, network=None):
 		self._vpn = None
+		# NetworkMonitor, to not try the network when offline
+		self.network = network
 
 	def mounted(self):
 		return self.retropie_roms().is_mount()
@@ -22,15 +24,18 @@ class Storage:
 	def connect(self):
 		if self.mounted():
 			return
-		# Just a slight network hickup
-		self.mount_net()
-		if self.mounted():
-			return
-		# Another network
-		self.start_vpn()
-		self.mount_net()
-		if self.mounted():
-			return
+		# The share is on the local network
+		if not self.network or self.network.connected:
+			# Just a slight network hickup
+			self.mount_net()
+			if self.mounted():
+				return
+		# Another network, only reachable through the internet
+		if not self.network or self.network.online:
+			self.start_vpn()
+			self.mount_net()
+			if self.mounted():
+				return
 		# Offline usage
 		self.mount_local()
 
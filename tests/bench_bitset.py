@@ -0,0 +1,129 @@
+"""
+Probe time and memory of the capabilities of a keyboard, a mouse and
+a gamepad, decoded into bitsets and as the dicts of codes that they
+replaced. The ioctls answer from the bitmaps in
+tests/fixtures/capabilities.json.
+
+	python3 tests/bench_bitset.py [rounds]
+"""
+import array
+import json
+import sys
+import timeit
+
+from conftest import module, FIXTURES
+
+event = module("event")
+
+Types = event.EventTypes
+Codes = event.EventCodes
+EV_SIZE = Types.EV_MAX // 8 + 1
+KEY_SIZE = Codes.KEY_MAX // 8 + 1
+PROP_SIZE = (0x1f + 7) // 8
+
+def bitmap(codes, size):
+	mask = 0
+	for code in codes:
+		mask |= 1 << code
+	return mask.to_bytes(size, 'little')
+
+class FakeDevice:
+	"""Answers to the ioctls of a probe."""
+	def __init__(self, fixture):
+		capabilities = {getattr(Types, name): codes for name, codes in fixture["capabilities"].items()}
+		self.responses = {
+			event.eviocgprop(PROP_SIZE): bitmap(fixture["properties"], PROP_SIZE),
+			event.eviocgeffects: array.array('i', [16]).tobytes(),
+			event.eviocgbit(0, EV_SIZE): bitmap(capabilities, EV_SIZE),
+		}
+		for ev_type, codes in capabilities.items():
+			self.responses[event.eviocgbit(ev_type, KEY_SIZE)] = bitmap(codes, KEY_SIZE)
+		for code in capabilities.get(Types.EV_ABS, []):
+			self.responses[event.eviocgabs(code)] = array.array('i', [128, 0, 255, 0, 15, 0]).tobytes()
+
+def ioctl(fd, request, buf):
+	data = fd.responses.get(request)
+	if data is None:
+		raise OSError("Unsupported")
+	memoryview(buf).cast('B')[:len(data)] = data
+
+def probe_dicts(fd):
+	"""The probe as before bitsets."""
+	test_bit = lambda bitmask, bit: bitmask[bit//8] & (1 << (bit % 8))
+	buf = array.array('B', [0] * PROP_SIZE)
+	properties = []
+	try:
+		ioctl(fd, event.eviocgprop(PROP_SIZE), buf)
+	except:
+		pass
+	else:
+		for i in range(0x1f):
+			if test_bit(buf, i):
+				properties.append(i)
+	buf = array.array('i', [0])
+	ioctl(fd, event.eviocgeffects, buf)
+	num_effects = buf[0]
+	ev_bits = array.array('B', [0] * EV_SIZE)
+	capabilities = {}
+	ioctl(fd, event.eviocgbit(0, EV_SIZE), ev_bits)
+	for ev_type in range(Types.EV_MAX):
+		if not test_bit(ev_bits, ev_type):
+			continue
+		eventcodes = {}
+		code_bits = array.array('B', [0] * KEY_SIZE)
+		try:
+			ioctl(fd, event.eviocgbit(ev_type, KEY_SIZE), code_bits)
+		except:
+			continue
+		for ev_code in range(Codes.KEY_MAX):
+			if not test_bit(code_bits, ev_code):
+				continue
+			if ev_type == Types.EV_ABS:
+				absinfo = array.array('i', [0] * 6)
+				try:
+					ioctl(fd, event.eviocgabs(ev_code), absinfo)
+				except:
+					continue
+				eventcodes[ev_code] = event.AbsValues(absinfo)
+			else:
+				eventcodes[ev_code] = True
+		capabilities[ev_type] = eventcodes
+	return properties, num_effects, capabilities
+
+def probe_bitsets(fd):
+	handler = event.EventHandler.__new__(event.EventHandler)
+	handler._fd = fd
+	handler._probe()
+	return handler._properties, handler._num_effects, handler._capabilities, handler._absinfo
+
+def sizeof(obj, seen=None):
+	"""Memory of an object and everything that it holds."""
+	seen = seen if seen is not None else set()
+	if id(obj) in seen:
+		return 0
+	seen.add(id(obj))
+	size = sys.getsizeof(obj)
+	if isinstance(obj, dict):
+		size += sum(sizeof(key, seen) + sizeof(value, seen) for key, value in obj.items())
+	elif isinstance(obj, (list, tuple)):
+		size += sum(sizeof(item, seen) for item in obj)
+	elif hasattr(obj, '__dict__'):
+		size += sizeof(vars(obj), seen)
+	elif hasattr(obj, '__slots__'):
+		size += sum(sizeof(getattr(obj, name), seen) for name in obj.__slots__)
+	return size
+
+def main():
+	rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+	event.ioctl = ioctl
+	with open(FIXTURES / "capabilities.json") as f:
+		fixtures = json.load(f)
+	print("{:>9} {:>8} {:>10} {:>10}".format("device", "probe", "us/probe", "bytes"))
+	for name, fixture in fixtures.items():
+		fd = FakeDevice(fixture)
+		for kind, probe in [("dicts", probe_dicts), ("bitsets", probe_bitsets)]:
+			best = min(timeit.repeat(lambda: probe(fd), number=rounds, repeat=5)) / rounds
+			print("{:>9} {:>8} {:>10.1f} {:>10}".format(name, kind, best * 1e6, sizeof(probe(fd))))
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,76 @@
+"""
+Throughput of the bluetoothctl parser, feeding a transcript through
+BluetoothCtl._line and the DeviceRegistry, as read from the process.
+The transcript is a raw recording of bluetoothctl output, or recorded
+from tests/fakes/bluetoothctl during a scan that finds NEARBY devices
+sending RSSI events.
+
+	python3 tests/bench_bluetooth.py [transcript] [rounds]
+"""
+import os
+import sys
+import threading
+import time
+from subprocess import Popen, PIPE
+
+from conftest import module, FAKES
+
+bluetooth = module("bluetooth")
+
+NEARBY = 200
+COMMANDS = [
+	"scan on",
+	"devices",
+	"info AA:BB:CC:DD:EE:01",
+	"pair AA:BB:CC:DD:EE:02",
+	"remove AA:BB:CC:DD:EE:03",
+	"scan off",
+]
+
+def record(duration=1.0):
+	"""Output of the fake during the commands."""
+	process = Popen([str(FAKES / "bluetoothctl")], stdin=PIPE, stdout=PIPE,
+		env=dict(os.environ, FAKE_BT_NOISE="0.0001", FAKE_BT_NEARBY=str(NEARBY)))
+	chunks = []
+	read = lambda: os.read(process.stdout.fileno(), 65536)
+	reader = threading.Thread(target=lambda: chunks.extend(iter(read, b'')))
+	reader.start()
+	for command in COMMANDS:
+		process.stdin.write(command.encode() + b'\n')
+		process.stdin.flush()
+		time.sleep(duration / len(COMMANDS))
+	process.stdin.close()
+	process.wait()
+	reader.join()
+	return b''.join(chunks)
+
+def feed(lines):
+	ctl = bluetooth.BluetoothCtl()
+	registry = bluetooth.DeviceRegistry()
+	events = [0]
+	def listener(line):
+		events[0] += 1
+		registry.feed(line)
+	ctl.listeners.append(listener)
+	for line in lines:
+		ctl._line(line.decode('utf-8', 'replace'))
+	return events[0], registry
+
+def main():
+	if len(sys.argv) > 1:
+		with open(sys.argv[1], 'rb') as f:
+			transcript = f.read()
+	else:
+		transcript = record()
+	rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+	lines = transcript.split(b'\n')
+	best = float('inf')
+	for _ in range(rounds):
+		start = time.perf_counter()
+		events, registry = feed(lines)
+		best = min(best, time.perf_counter() - start)
+	print("{} lines, {} events, {} devices".format(len(lines), events, len(registry)))
+	print("{:.0f} lines/s, {:.1f} us/line".format(len(lines) / best, best / len(lines) * 1e6))
+
+if __name__ == "__main__":
+	main()
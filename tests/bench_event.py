@@ -0,0 +1,90 @@
+"""
+Dispatch latency and CPU use of N simulated devices, with FIFOs
+standing in for /dev/input/event*, in reactor and thread mode.
+
+	python3 tests/bench_event.py [rounds]
+"""
+import os
+import random
+import statistics
+import struct
+import sys
+import tempfile
+import threading
+import time
+
+from conftest import module
+
+event = module("event")
+
+SIZES = [1, 2, 4, 8, 16, 32, 64, 128, 256]
+IDLE = 1.0
+
+def frame():
+	data = struct.pack('llHHi', 0, 0, event.EventTypes.EV_KEY, 1, 1)
+	return data + struct.pack('llHHi', 0, 0, event.EventTypes.EV_SYN, event.EventCodes.SYN_REPORT, 0)
+
+def fifo(dev):
+	"""
+	A FIFO standing in for a device, and its write end.
+	Opened for reading too, so that opening does not block.
+	"""
+	os.mkfifo(dev)
+	return os.open(dev, os.O_RDWR | os.O_NONBLOCK)
+
+def run(n, rounds, reactor):
+	received = threading.Semaphore(0)
+	arrived = [0.0]
+	def callback(ctrl, evtype, code, value):
+		if evtype == event.EventTypes.EV_KEY:
+			arrived[0] = time.perf_counter()
+			received.release()
+	with tempfile.TemporaryDirectory() as path:
+		writers = []
+		devices = []
+		for i in range(n):
+			dev = "{}/event{}".format(path, i)
+			writers.append(fifo(dev))
+			devices.append(event.GeneralEvent(dev, callback, reactor))
+		for device in devices:
+			device.probe()
+
+		# Idle cost of having the devices open
+		cpu = time.process_time()
+		time.sleep(IDLE)
+		idle = (time.process_time() - cpu) / IDLE
+
+		data = frame()
+		latencies = []
+		cpu = time.process_time()
+		for _ in range(rounds):
+			fd = random.choice(writers)
+			sent = time.perf_counter()
+			os.write(fd, data)
+			received.acquire()
+			latencies.append(arrived[0] - sent)
+		busy = (time.process_time() - cpu) / rounds
+
+		# Blocked readers see the end of their FIFO
+		for fd in writers:
+			os.close(fd)
+		for device in devices:
+			device.close()
+	latencies.sort()
+	return statistics.median(latencies), latencies[int(len(latencies) * 0.99) - 1], busy, idle
+
+def main():
+	rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+	event.EventHandler.cache = None
+	print("{:>4} {:>8} {:>10} {:>10} {:>12} {:>8}".format("n", "mode", "median us", "p99 us", "cpu us/ev", "idle %"))
+	for n in SIZES:
+		for mode in ["reactor", "thread"]:
+			reactor = event.Reactor() if mode == "reactor" else None
+			median, p99, busy, idle = run(n, rounds, reactor)
+			if reactor:
+				reactor.close()
+			print("{:>4} {:>8} {:>10.1f} {:>10.1f} {:>12.1f} {:>8.2f}".format(
+				n, mode, median * 1e6, p99 * 1e6, busy * 1e6, idle * 100))
+
+if __name__ == "__main__":
+	main()
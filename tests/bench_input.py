@@ -0,0 +1,97 @@
+"""
+Per-event dispatch cost of Input.update over an event stream,
+through the compiled keymap and through the if/elif chain that it
+replaced. The stream is a raw recording of a device, as made with
+`cat /dev/input/eventN > pad.events`, or a synthesized gamepad
+session of stick sweeps and button presses.
+
+	python3 tests/bench_input.py [recording] [rounds]
+"""
+import math
+import struct
+import sys
+import time
+
+from conftest import module
+
+event = module("event")
+lounge = module("__main__")
+
+Types = event.EventTypes
+Codes = event.EventCodes
+EVENT = struct.Struct('llHHi')
+
+class ChainInput(lounge.Input):
+	"""Dispatch as it was before the keymap."""
+	ENTER = [Codes.BTN_A, Codes.KEY_ENTER, Codes.BTN_LEFT]
+	BACK = [Codes.BTN_B, Codes.KEY_ESC, Codes.BTN_RIGHT]
+
+	def update(self, ctrl, evtype, code, value):
+		if evtype == Types.EV_KEY:
+			if code in self.ENTER:
+				self._enter(ctrl, code, value)
+			elif code in self.BACK:
+				self._back(ctrl, code, value)
+			elif code == Codes.KEY_DOWN:
+				self._down(ctrl, code, value)
+			elif code == Codes.KEY_UP:
+				self._up(ctrl, code, value)
+		elif evtype == Types.EV_REL:
+			if code == Codes.REL_WHEEL:
+				self._direction(ctrl, code, value)
+		elif evtype == Types.EV_ABS:
+			if code == Codes.ABS_HAT0Y:
+				self._direction(ctrl, code, value)
+			elif code in [Codes.ABS_Y, Codes.ABS_RZ]:
+				self._axis(ctrl, code, value)
+
+class Ctrl:
+	name = "Pad"
+	probed = True
+	axes = {code: event.AbsAxis(event.AbsValues((0, 0, 255, 0, 15, 0))) for code in [Codes.ABS_X, Codes.ABS_Y, Codes.ABS_RZ]}
+
+def synthesize(frames=20000):
+	"""Both sticks sweeping, with a button press every 100 frames."""
+	events = []
+	for i in range(frames):
+		x = int(127.5 + 127.5 * math.sin(i / 50.0))
+		y = int(127.5 + 127.5 * math.cos(i / 70.0))
+		events += [(Types.EV_ABS, Codes.ABS_X, x), (Types.EV_ABS, Codes.ABS_Y, y), (Types.EV_ABS, Codes.ABS_RZ, x)]
+		if i % 100 == 0:
+			button = Codes.BTN_A if i % 200 else Codes.BTN_B
+			events += [(Types.EV_MSC, 4, 0x90001), (Types.EV_KEY, button, 1)]
+		elif i % 100 == 1:
+			events.append((Types.EV_KEY, Codes.BTN_A if (i - 1) % 200 else Codes.BTN_B, 0))
+		events.append((Types.EV_SYN, Codes.SYN_REPORT, 0))
+	return events
+
+def load(path):
+	with open(path, 'rb') as f:
+		data = f.read()
+	data = data[:len(data) - len(data) % EVENT.size]
+	return [(evtype, code, value) for _, _, evtype, code, value in EVENT.iter_unpack(data)]
+
+def measure(cls, events, rounds):
+	ctrl = Ctrl()
+	# Large enough to never drop, so that only dispatch is measured
+	input_ctrl = cls(queue=lounge.EventQueue(len(events), lounge.EventQueue.DROP_OLDEST))
+	update = input_ctrl.update
+	best = math.inf
+	for _ in range(rounds):
+		input_ctrl.reset()
+		start = time.perf_counter()
+		for evtype, code, value in events:
+			update(ctrl, evtype, code, value)
+		best = min(best, time.perf_counter() - start)
+	return best / len(events)
+
+def main():
+	events = load(sys.argv[1]) if len(sys.argv) > 1 else synthesize()
+	rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+	print("{} events".format(len(events)))
+	print("{:>8} {:>10}".format("dispatch", "ns/event"))
+	for name, cls in [("chain", ChainInput), ("keymap", lounge.Input)]:
+		print("{:>8} {:>10.1f}".format(name, measure(cls, events, rounds) * 1e9))
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,105 @@
+"""
+Work done per navigation step of a sub menu, painting only the rows
+that changed and redrawing the whole screen as before. Counts the
+writes and text through a RecordingRenderer, and the bytes that an
+AnsiRenderer sends to the terminal. Then scrolls through lists of up
+to 10k items, where the work of each paint is bounded by the height
+of the screen rather than the length of the list.
+
+	python3 tests/bench_menu.py [items] [steps]
+"""
+import io
+import random
+import sys
+import time
+
+from conftest import module
+
+menu_module = module("menu")
+render = module("render")
+
+SIZES = [24, 100, 1000, 10000]
+
+class FullSubMenu(menu_module.SubMenu):
+	"""Redraws everything on each paint, as before dirty rows."""
+	def paint(self):
+		self.invalidate()
+		super().paint()
+
+class Tee(render.Renderer):
+	"""Draws with several renderers at once."""
+	def __init__(self, *renderers):
+		self.renderers = renderers
+
+	def size(self):
+		return self.renderers[0].size()
+
+	def erase(self):
+		for renderer in self.renderers:
+			renderer.erase()
+
+	def write(self, y, x, text, style=render.Renderer.NORMAL):
+		for renderer in self.renderers:
+			renderer.write(y, x, text, style)
+
+	def clear_line(self, y, x):
+		for renderer in self.renderers:
+			renderer.clear_line(y, x)
+
+	def flush(self):
+		for renderer in self.renderers:
+			renderer.flush()
+
+def run(cls, items, steps, lines=24):
+	recording = render.RecordingRenderer(lines)
+	out = io.StringIO()
+	menu = menu_module.Menu(renderer=Tee(recording, render.AnsiRenderer(out)))
+	sub = cls(menu)
+	for i in range(items):
+		sub.add(str(i), "Item {}".format(i), None)
+	sub.paint()
+	recording.reset()
+	sent = out.tell()
+	for i in range(steps):
+		# Down most of the time, as when scrolling through a list
+		sub.jump(-1 if i % 4 == 3 else 1)
+		sub.paint()
+	return recording.calls["write"] / steps, recording.bytes / steps, (out.tell() - sent) / steps
+
+def scroll(items, steps, lines=24):
+	"""Worst calls and average time of a paint, for steps and page jumps."""
+	recording = render.RecordingRenderer(lines)
+	menu = menu_module.Menu(renderer=recording)
+	sub = menu.sub_menu()
+	for i in range(items):
+		sub.add(str(i), "Item {}".format(i), None)
+	sub.paint()
+	worst = 0
+	elapsed = 0.0
+	rng = random.Random(items)
+	for _ in range(steps):
+		sub.jump(rng.choice([1, 1, 1, -1, lines, -lines, items // 2]))
+		recording.reset()
+		start = time.perf_counter()
+		sub.paint()
+		elapsed += time.perf_counter() - start
+		worst = max(worst, recording.calls["write"] + recording.calls["clear_line"])
+	# A key, a text and the rest of the line cleared, for each line
+	assert worst <= 3 * lines, "{} calls for {} lines".format(worst, lines)
+	return worst, elapsed / steps
+
+def main():
+	items = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+	steps = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+	print("{:>6} {:>8} {:>12} {:>12} {:>12}".format("items", "paint", "writes/step", "text B/step", "ansi B/step"))
+	for name, cls in [("full", FullSubMenu), ("dirty", menu_module.SubMenu)]:
+		writes, text, sent = run(cls, items, steps)
+		print("{:>6} {:>8} {:>12.1f} {:>12.1f} {:>12.1f}".format(items, name, writes, text, sent))
+	print()
+	print("{:>6} {:>12} {:>12}".format("items", "worst calls", "us/paint"))
+	for size in SIZES:
+		worst, paint = scroll(size, steps)
+		print("{:>6} {:>12} {:>12.1f}".format(size, worst, paint * 1e6))
+
+if __name__ == "__main__":
+	main()
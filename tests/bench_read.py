@@ -0,0 +1,95 @@
+"""
+Read syscalls and events per second of one device in reactor mode,
+with batched reads and with one read() per event as before, for
+bursts of frames written at once.
+
+	python3 tests/bench_read.py [rounds]
+"""
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from conftest import module
+from bench_event import fifo, frame
+
+event = module("event")
+
+BURSTS = [1, 4, 16, 64, 256]
+
+class SingleRead(event.GeneralEvent):
+	"""Reads as before batching, one event per read()."""
+	def read(self):
+		evbuf = self._fd.read(self._input.size)
+		if not self._wait.is_set():
+			return
+		if not evbuf:
+			return
+		self.event(*self._input.unpack(evbuf))
+
+class CountingFile:
+	"""Counts the reads of a device."""
+	def __init__(self, f):
+		self._f = f
+		self.calls = 0
+
+	def read(self, size):
+		self.calls += 1
+		return self._f.read(size)
+
+	def readinto(self, buffer):
+		self.calls += 1
+		return self._f.readinto(buffer)
+
+	def fileno(self):
+		return self._f.fileno()
+
+	def close(self):
+		self._f.close()
+
+	@property
+	def closed(self):
+		return self._f.closed
+
+def run(cls, burst, rounds):
+	data = frame() * burst
+	expected = 2 * burst
+	received = [0]
+	done = threading.Event()
+	def callback(ctrl, evtype, code, value):
+		received[0] += 1
+		if received[0] == expected:
+			done.set()
+	reactor = event.Reactor()
+	with tempfile.TemporaryDirectory() as path:
+		dev = "{}/event0".format(path)
+		writer = fifo(dev)
+		device = cls(dev, callback, reactor)
+		device.probe()
+		device._fd = counting = CountingFile(device._fd)
+		elapsed = 0.0
+		for _ in range(rounds):
+			received[0] = 0
+			done.clear()
+			start = time.perf_counter()
+			os.write(writer, data)
+			done.wait()
+			elapsed += time.perf_counter() - start
+		os.close(writer)
+		device.close()
+	reactor.close()
+	events = expected * rounds
+	return counting.calls / events, events / elapsed
+
+def main():
+	rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+	event.EventHandler.cache = None
+	print("{:>6} {:>8} {:>12} {:>12}".format("burst", "read", "reads/event", "events/s"))
+	for burst in BURSTS:
+		for name, cls in [("single", SingleRead), ("batch", event.GeneralEvent)]:
+			reads, rate = run(cls, burst, rounds)
+			print("{:>6} {:>8} {:>12.3f} {:>12.0f}".format(burst, name, reads, rate))
+
+if __name__ == "__main__":
+	main()
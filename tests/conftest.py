@@ -0,0 +1,13 @@
+import importlib
+import sys
+from pathlib import Path
+
+# The repository is the package, whatever its directory is called
+ROOT = Path(__file__).resolve().parent.parent
+FAKES = Path(__file__).resolve().parent / "fakes"
+FIXTURES = Path(__file__).resolve().parent / "fixtures"
+sys.path.insert(0, str(ROOT.parent))
+
+def module(name):
+	"""Imports a module of the package."""
+	return importlib.import_module("{}.{}".format(ROOT.name, name))
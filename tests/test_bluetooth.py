@@ -0,0 +1,121 @@
+import time
+
+import pytest
+
+from conftest import module, FAKES
+
+bluetooth = module("bluetooth")
+
+MAC = "AA:BB:CC:DD:EE:01"
+
+@pytest.fixture
+def fake(monkeypatch):
+	monkeypatch.setenv("PATH", "{}:{}".format(FAKES, __import__("os").environ["PATH"]))
+
+@pytest.fixture
+def ctl(fake):
+	ctl = bluetooth.BluetoothCtl()
+	yield ctl
+	ctl.close()
+
+def test_command(ctl):
+	assert ctl.command("devices") == ["Device AA:BB:CC:DD:EE:01 Pad One", "Device AA:BB:CC:DD:EE:02 Pad Two"]
+	assert ctl.command("paired-devices") == ["Invalid command"]
+	assert ctl.command("devices", "Paired") == ["Device AA:BB:CC:DD:EE:01 Pad One"]
+
+def test_command_during_events(fake, monkeypatch):
+	# Prompts are redrawn after each event
+	monkeypatch.setenv("FAKE_BT_NOISE", "0.001")
+	ctl = bluetooth.BluetoothCtl()
+	events = []
+	ctl.listeners.append(events.append)
+	try:
+		for _ in range(100):
+			assert len(ctl.command("devices")) == 2
+	finally:
+		ctl.close()
+	assert events and all(event.startswith("[CHG] Device AA:BB:CC:DD:EE:02 RSSI") for event in events)
+
+def test_restarts(ctl):
+	ctl.command("devices")
+	ctl._process.kill()
+	ctl._process.wait()
+	assert len(ctl.command("devices")) == 2
+
+def test_feed():
+	registry = bluetooth.DeviceRegistry()
+	changes = []
+	registry.subscribers.append(lambda kind, device: changes.append((kind, device.name, device.paired, device.rssi)))
+	for line in [
+		"[NEW] Device AA:BB:CC:DD:EE:01 Pad",
+		"[CHG] Device AA:BB:CC:DD:EE:01 RSSI: 0xffffffc4 (-60)",
+		"[CHG] Device AA:BB:CC:DD:EE:01 RSSI: -61",
+		"[CHG] Device AA:BB:CC:DD:EE:01 Paired: yes",
+		# Unchanged, or not kept
+		"[CHG] Device AA:BB:CC:DD:EE:01 Paired: yes",
+		"[CHG] Device AA:BB:CC:DD:EE:01 ManufacturerData Key: 0x004c",
+		"[CHG] Controller 00:11:22:33:44:55 Discovering: yes",
+		"[CHG] Device AA:BB:CC:DD:EE:01 Alias: Pad One",
+		"[DEL] Device AA:BB:CC:DD:EE:01 Pad One",
+	]:
+		registry.feed(line)
+	assert changes == [
+		("new", "Pad", False, None),
+		("change", "Pad", False, -60),
+		("change", "Pad", False, -61),
+		("change", "Pad", True, -61),
+		("change", "Pad One", True, -61),
+		("delete", "Pad One", True, -61),
+	]
+	assert MAC not in registry
+
+def test_registry_from_session(fake):
+	bt = bluetooth.Bluetooth()
+	try:
+		registry = bt.refresh()
+		assert [(device.mac, device.paired) for device in registry] == [(MAC, True), ("AA:BB:CC:DD:EE:02", False)]
+		found = []
+		bt.scan(lambda mac, name: found.append((mac, name)))
+		for _ in range(20):
+			if found:
+				break
+			time.sleep(0.05)
+		bt.cancel()
+		assert found == [("AA:BB:CC:DD:EE:03", "Pad Three")]
+	finally:
+		bt.ctl.close()
+
+def test_pairing_in_parallel(fake):
+	bt = bluetooth.Bluetooth()
+	try:
+		bt.refresh()
+		progress = []
+		start = time.monotonic()
+		pairings = [bt.pair_device(mac, lambda mac, state: progress.append((mac, state)), timeout=1.0)
+			for mac in ["AA:BB:CC:DD:EE:02", "AA:BB:CC:DD:EE:09"]]
+		assert [pairing.wait() for pairing in pairings] == [True, False]
+		assert time.monotonic() - start < 1.5
+		assert [state for mac, state in progress if mac == "AA:BB:CC:DD:EE:02"] == ["pairing", "trusting", "connecting", "connected"]
+		assert ("AA:BB:CC:DD:EE:09", "failed") in progress
+	finally:
+		bt.ctl.close()
+
+def test_reconnect_with_removed_device(fake, monkeypatch):
+	monkeypatch.setattr(bluetooth.Reconnector, "ATTEMPTS", 1)
+	bt = bluetooth.Bluetooth()
+	try:
+		bt.refresh()
+		# Paired, but it never answers
+		bt.registry.update("AA:BB:CC:DD:EE:09", paired=True)
+		reconnector = bluetooth.Reconnector(bt, timeout=0.5)
+		reconnector.start()
+		time.sleep(0.2)
+		bt.registry.remove("AA:BB:CC:DD:EE:09")
+		for _ in range(40):
+			if reconnector.elapsed is not None:
+				break
+			time.sleep(0.05)
+		assert reconnector.elapsed is not None
+		assert bt.registry.get(MAC).connected
+	finally:
+		bt.ctl.close()
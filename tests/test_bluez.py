@@ -0,0 +1,80 @@
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+import pytest
+
+from conftest import module, FAKES
+
+dbus = pytest.importorskip("dbus")
+pytest.importorskip("gi")
+if not shutil.which("dbus-daemon"):
+	pytest.skip("dbus-daemon is needed for the stub service", allow_module_level=True)
+bluez = module("bluez")
+
+@pytest.fixture(scope="module")
+def address():
+	daemon = subprocess.Popen(["dbus-daemon", "--session", "--nofork", "--print-address=1"], stdout=subprocess.PIPE)
+	yield daemon.stdout.readline().decode('utf-8').strip()
+	daemon.terminate()
+	daemon.wait()
+
+@pytest.fixture
+def bt(address):
+	# Signals need the main loop before the bus
+	bluez.BluezBluetooth._start_loop()
+	bus = dbus.bus.BusConnection(address)
+	service = subprocess.Popen([sys.executable, str(FAKES / "bluez")], env=dict(os.environ, DBUS_SESSION_BUS_ADDRESS=address))
+	assert wait(lambda: bus.name_has_owner(bluez.BLUEZ))
+	yield bluez.BluezBluetooth(bus)
+	service.terminate()
+	service.wait()
+	bus.close()
+
+def wait(condition, timeout=5.0):
+	end = time.monotonic() + timeout
+	while not condition() and time.monotonic() < end:
+		time.sleep(0.01)
+	return condition()
+
+def test_refresh(bt):
+	devices = {device.mac: device for device in bt.refresh()}
+	assert sorted(devices) == ["AA:BB:CC:DD:EE:01", "AA:BB:CC:DD:EE:02", "AA:BB:CC:DD:EE:09"]
+	device = devices["AA:BB:CC:DD:EE:01"]
+	assert (device.name, device.paired, device.trusted, device.connected, device.rssi) == ("Pad One", True, True, False, -60)
+	assert type(device.name) is str and type(device.paired) is bool and type(device.rssi) is int
+	assert bt.get_paired() == [("AA:BB:CC:DD:EE:01", "Pad One")]
+	assert bt.device_info("AA:BB:CC:DD:EE:02") == {"name": "Pad Two", "paired": False, "trusted": False, "connected": False}
+
+def test_scan(bt):
+	bt.refresh()
+	found = []
+	bt.scan(lambda mac, name: found.append((mac, name)))
+	assert wait(lambda: found)
+	bt.cancel()
+	assert found == [("AA:BB:CC:DD:EE:03", "Pad Three")]
+
+def test_pairing_in_parallel(bt):
+	bt.refresh()
+	progress = []
+	pairings = [bt.pair_device(mac, lambda mac, state: progress.append((mac, state)), timeout=1.5)
+		for mac in ["AA:BB:CC:DD:EE:02", "AA:BB:CC:DD:EE:09"]]
+	assert [pairing.wait() for pairing in pairings] == [True, False]
+	assert [state for mac, state in progress if mac == "AA:BB:CC:DD:EE:02"] == ["pairing", "trusting", "connecting", "connected"]
+	device = bt.registry.get("AA:BB:CC:DD:EE:02")
+	assert device.paired and device.trusted and device.connected
+
+def test_remove(bt):
+	bt.refresh()
+	changes = []
+	bt.registry.subscribers.append(lambda kind, device: changes.append((kind, device.mac)))
+	bt.remove_device("AA:BB:CC:DD:EE:01")
+	assert wait(lambda: changes)
+	assert changes == [("delete", "AA:BB:CC:DD:EE:01")]
+	assert "AA:BB:CC:DD:EE:01" not in bt.registry
+
+def test_unknown_device(bt):
+	bt.refresh()
+	assert not bt.pair_device("00:00:00:00:00:00", timeout=0.5).wait()
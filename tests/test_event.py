@@ -0,0 +1,235 @@
+import os
+import struct
+import threading
+import time
+
+import pytest
+
+from conftest import module
+
+pytest.importorskip("inotify_simple")
+event = module("event")
+
+@pytest.fixture
+def fifo(tmp_path):
+	path = str(tmp_path / "event0")
+	os.mkfifo(path)
+	# Read and write end, so that opening does not block
+	fd = os.open(path, os.O_RDWR | os.O_NONBLOCK)
+	yield path, fd
+	os.close(fd)
+
+@pytest.fixture
+def reactor():
+	reactor = event.Reactor()
+	yield reactor
+	reactor.close()
+
+def frame(*events):
+	data = b''.join(struct.pack('llHHi', 0, 0, *e) for e in events)
+	return data + struct.pack('llHHi', 0, 0, event.EventTypes.EV_SYN, event.EventCodes.SYN_REPORT, 0)
+
+def test_axes_kept_when_coalescing(fifo, reactor, monkeypatch):
+	path, fd = fifo
+	monkeypatch.setattr(event.EventHandler, "coalesce", True)
+	monkeypatch.setattr(event.EventHandler, "cache", None)
+	received = threading.Semaphore(0)
+	values = []
+	def callback(ctrl, evtype, code, value):
+		if evtype == event.EventTypes.EV_ABS:
+			values.append(ctrl.axes[code].normalize(value))
+			received.release()
+	ctrl = event.GeneralEvent(path, callback, reactor)
+	ctrl.probe()
+	# As if probed from a stick of 0..255
+	ctrl._absinfo = {1: event.AbsValues((0, 0, 255, 0, 15, 0))}
+	ctrl._loaded()
+
+	for value in [255, 128, 0]:
+		os.write(fd, frame((event.EventTypes.EV_ABS, 1, value)))
+		assert received.acquire(timeout=2)
+	assert list(ctrl.axes) == [1]
+	assert values == [1.0, 0.0, -1.0]
+	ctrl.close()
+
+class CountingFile:
+	"""Counts the reads of a device."""
+	def __init__(self, f):
+		self._f = f
+		self.reads = []
+	def readinto(self, buffer):
+		n = self._f.readinto(buffer)
+		self.reads.append(n)
+		return n
+	def fileno(self):
+		return self._f.fileno()
+	def close(self):
+		self._f.close()
+	@property
+	def closed(self):
+		return self._f.closed
+
+def test_batch_read_drains_to_eagain(fifo, reactor, monkeypatch):
+	path, fd = fifo
+	monkeypatch.setattr(event.EventHandler, "cache", None)
+	batches = []
+	received = threading.Event()
+	def batch_callback(ctrl, batch):
+		batches.append(batch)
+		received.set()
+	ctrl = event.GeneralEvent(path, None, reactor, batch_callback)
+	ctrl._fd = counting = CountingFile(ctrl._fd)
+	size = struct.calcsize('llHHi')
+
+	# Two full buffers, written at once
+	keys = [(event.EventTypes.EV_KEY, 0x130, i % 2) for i in range(event.EventHandler.BATCH - 1)]
+	os.write(fd, frame(*keys) * 2)
+	assert received.wait(2)
+	# Filled twice, then nothing is left
+	assert counting.reads == [size * event.EventHandler.BATCH] * 2 + [None]
+	assert len(batches) == 1
+	assert [e[2:] for e in batches[0]] == (keys + [(event.EventTypes.EV_SYN, event.EventCodes.SYN_REPORT, 0)]) * 2
+
+	# A partial buffer ends the batch without reading again
+	received.clear()
+	counting.reads.clear()
+	os.write(fd, frame(*keys[:2]))
+	assert received.wait(2)
+	assert counting.reads == [size * 3]
+	assert len(batches[1]) == 3
+	ctrl.close()
+
+def test_reactor_survives_failing_callback(reactor):
+	broken, working = os.pipe(), os.pipe()
+	called = threading.Event()
+	def fail():
+		os.read(broken[0], 1)
+		raise FileNotFoundError("gone")
+	def succeed():
+		os.read(working[0], 1)
+		called.set()
+	reactor.register(broken[0], fail)
+	reactor.register(working[0], succeed)
+	os.write(broken[1], b'x')
+	os.write(working[1], b'x')
+	assert called.wait(2)
+	reactor.unregister(broken[0])
+	reactor.unregister(working[0])
+
+class FakeDevice:
+	def __init__(self, dev):
+		self.dev = dev
+		self.first_event = None
+	def is_connected(self):
+		return True
+	def close(self):
+		pass
+
+class FakeEvent:
+	def __init__(self, name, mask):
+		self.name = name
+		self.mask = mask
+
+def test_hotplug_retry_does_not_block_reactor(tmp_path, reactor, monkeypatch):
+	monkeypatch.setattr(event.EventManager, "get_path", lambda self: str(tmp_path))
+	openable = set()
+	monkeypatch.setattr(event.EventManager, "is_valid_dev", staticmethod(lambda dev: dev in openable))
+	manager = event.EventManager(FakeDevice, reactor)
+	(tmp_path / "event3").touch()
+	manager._handle([FakeEvent("event3", event.flags.CREATE), FakeEvent("event3", event.flags.ATTRIB)])
+	assert "event3" in manager._pending
+
+	# Input from other devices is still dispatched
+	r, w = os.pipe()
+	called = threading.Event()
+	reactor.register(r, lambda: called.set() or os.read(r, 1))
+	os.write(w, b'x')
+	assert called.wait(1)
+	reactor.unregister(r)
+
+	# Added once it can be opened
+	openable.add("{}/event3".format(tmp_path))
+	for _ in range(20):
+		if manager.devices:
+			break
+		threading.Event().wait(0.1)
+	assert [device.dev for device in manager.devices] == ["{}/event3".format(tmp_path)]
+	assert not manager._pending
+	manager.close()
+
+def test_hotplug_latency_includes_pending(tmp_path, reactor, monkeypatch):
+	monkeypatch.setattr(event.EventManager, "get_path", lambda self: str(tmp_path))
+	dev = "{}/event3".format(tmp_path)
+	openable = set()
+	monkeypatch.setattr(event.EventManager, "is_valid_dev", staticmethod(lambda dev: dev in openable))
+	manager = event.EventManager(FakeDevice, reactor)
+	(tmp_path / "event3").touch()
+	before = time.monotonic()
+	manager._handle([FakeEvent("event3", event.flags.CREATE), FakeEvent("event3", event.flags.ATTRIB)])
+	after = time.monotonic()
+	time.sleep(0.2)
+	openable.add(dev)
+	for _ in range(20):
+		if manager.devices:
+			break
+		time.sleep(0.1)
+	device = manager.devices[0]
+	assert manager.latencies() == {}
+	device.first_event = time.monotonic()
+	# From when it was plugged in, rather than opened
+	assert device.first_event - after <= manager.latencies()[dev] <= device.first_event - before
+	assert manager.latencies()[dev] >= 0.2
+	manager._handle([FakeEvent("event3", event.flags.DELETE)])
+	assert dev not in manager._plugged
+	manager.close()
+
+def test_reactor_sleeps_until_woken():
+	reactor = event.Reactor()
+	timeouts = []
+	select = reactor._selector.select
+	def recording(timeout=None):
+		timeouts.append(timeout)
+		return select(timeout)
+	reactor._selector.select = recording
+	called = threading.Event()
+	# Sleeping since started, without a timer
+	reactor.call_later(0.01, called.set)
+	assert called.wait(1)
+	deadline = time.monotonic() + 1
+	while timeouts[-1] is not None and time.monotonic() < deadline:
+		time.sleep(0.01)
+	assert timeouts[-1] is None
+	# An earlier timer wakes it
+	called.clear()
+	reactor.call_later(60, lambda: None)
+	reactor.call_later(0.01, called.set)
+	assert called.wait(1)
+	start = time.monotonic()
+	reactor.close()
+	assert time.monotonic() - start < 0.5
+
+def test_bitset():
+	bits = event.Bitset.from_bytes(bytes([0b00000101, 0, 0b10000000]))
+	assert list(bits) == [0, 2, 23]
+	assert len(bits) == 3
+	assert 2 in bits and 23 in bits
+	assert 1 not in bits and 24 not in bits and -1 not in bits
+	assert bits == event.Bitset((1 << 0) | (1 << 2) | (1 << 23))
+	assert not event.Bitset.from_bytes(bytes(4))
+	assert len(event.Bitset()) == 0
+
+def test_device_cache(tmp_path):
+	path = str(tmp_path / "devices.json")
+	key = (3, 0x45e, 0x28e, 0x110, "Pad", "")
+	info = (event.Bitset(1 << 5), 16, {event.EventTypes.EV_KEY: event.Bitset(1 << 0x130), event.EventTypes.EV_ABS: event.Bitset(0b11)},
+		{0: event.AbsValues((0, 0, 255, 0, 15, 0)), 1: event.AbsValues((0, -32768, 32767, 16, 128, 0))})
+	event.DeviceCache(path).put(key, 0x10001, info)
+
+	# Read back from disk
+	cache = event.DeviceCache(path)
+	properties, num_effects, capabilities, absinfo = cache.get(key, 0x10001)
+	assert (properties, num_effects, capabilities) == info[:3]
+	assert {code: repr(values) for code, values in absinfo.items()} == {code: repr(values) for code, values in info[3].items()}
+	assert cache.get(key[:-1] + ("other",), 0x10001) is None
+	# Another driver version probes again
+	assert cache.get(key, 0x10002) is None
@@ -0,0 +1,112 @@
+import threading
+import time
+
+import pytest
+
+from conftest import module
+
+pytest.importorskip("inotify_simple")
+main = module("__main__")
+
+MOVE, ENTER, BACK = 0, 1, 2
+
+class FakeCtrl:
+	name = "Pad"
+	probed = True
+	def __init__(self, axes=None):
+		self.axes = axes if axes else {}
+
+def dispatched(ctrl, events, keymap=None):
+	input_ctrl = main.Input(keymap, queue=main.EventQueue(policy=main.EventQueue.DROP_OLDEST))
+	for evtype, code, value in events:
+		input_ctrl.update(ctrl, evtype, code, value)
+	return list(input_ctrl.queue._queue)
+
+def test_queue_keeps_actions_when_full():
+	queue = main.EventQueue(3, main.EventQueue.DROP_OLDEST)
+	for event in [(ENTER, True), (MOVE, 1), (MOVE, 1), (MOVE, -1), (MOVE, 1)]:
+		queue.put(event)
+	assert list(queue._queue) == [(ENTER, True), (MOVE, -1), (MOVE, 1)]
+	assert queue.stats()["dropped"] == 2
+
+def test_queue_drops_new_move_when_full_of_actions():
+	queue = main.EventQueue(2, main.EventQueue.MERGE)
+	for event in [(ENTER, True), (BACK, True), (MOVE, 1)]:
+		queue.put(event)
+	assert list(queue._queue) == [(ENTER, True), (BACK, True)]
+	queue.put((ENTER, True))
+	assert list(queue._queue) == [(BACK, True), (ENTER, True)]
+
+def test_queue_merges_moves():
+	queue = main.EventQueue(3, main.EventQueue.MERGE)
+	for event in [(MOVE, 1), (MOVE, 1), (ENTER, True), (MOVE, -1), (MOVE, 1), (MOVE, 1)]:
+		queue.put(event)
+	assert queue.drain() == [(MOVE, 2), (ENTER, True)]
+	assert queue.drain() == [(MOVE, 1)]
+
+def test_update_dispatch():
+	event = module("event")
+	Types, Codes = event.EventTypes, event.EventCodes
+	events = [
+		(Types.EV_KEY, Codes.BTN_A, 1),
+		(Types.EV_KEY, Codes.BTN_A, 0),
+		(Types.EV_KEY, Codes.KEY_DOWN, 1),
+		(Types.EV_REL, Codes.REL_WHEEL, -1),
+		(Types.EV_KEY, Codes.KEY_ESC, 1),
+		# Not bound
+		(Types.EV_KEY, Codes.BTN_X, 1),
+		(Types.EV_SYN, Codes.SYN_REPORT, 0),
+	]
+	assert dispatched(FakeCtrl(), events) == [(ENTER, True), (MOVE, 1), (MOVE, -1), (BACK, True)]
+
+def test_update_axis():
+	event = module("event")
+	Types, Codes = event.EventTypes, event.EventCodes
+	ctrl = FakeCtrl({Codes.ABS_Y: event.AbsAxis(event.AbsValues((0, 0, 255, 0, 0, 0)))})
+	events = [(Types.EV_ABS, Codes.ABS_Y, value) for value in [255, 250, 128, 0]]
+	assert dispatched(ctrl, events) == [(MOVE, 1), (MOVE, -1)]
+	# Ranges are not known yet
+	ctrl.probed = False
+	assert dispatched(ctrl, events) == []
+
+def test_update_keymap():
+	Keymap = module("keymap").Keymap
+	event = module("event")
+	keymap = Keymap({Keymap.EVENT: {"enter": ["BTN_X"]}, Keymap.REMOTE: {"back": ["KEY_OK"]}})
+	assert dispatched(FakeCtrl(), [(event.EventTypes.EV_KEY, event.EventCodes.BTN_A, 1), (event.EventTypes.EV_KEY, event.EventCodes.BTN_X, 1)], keymap) == [(ENTER, True)]
+	input_ctrl = main.Input(keymap, queue=main.EventQueue())
+	input_ctrl.update_remote(module("remote").KeyCodes.KEY_OK, 1)
+	assert list(input_ctrl.queue._queue) == [(BACK, True)]
+
+def test_draw_time_until_frame_drawn():
+	render = module("render")
+	menu_module = module("menu")
+	menu = menu_module.Menu(fps=20, renderer=render.RecordingRenderer())
+	ctrl = main.Input(queue=main.EventQueue())
+	with menu:
+		interactive = main.InteractiveMenu(menu.sub_menu(), ctrl)
+		slow = threading.Event()
+		interactive.menu.add("X", "Back", interactive.runner)
+		interactive.menu.add("1", "One", lambda: slow.wait(0.3))
+		thread = threading.Thread(target=interactive, daemon=True)
+		thread.start()
+		try:
+			assert menu.visible.wait(1)
+
+			ctrl.queue.put((MOVE, 1))
+			for _ in range(50):
+				if interactive.draw_time:
+					break
+				time.sleep(0.01)
+			# At most a frame at 20 fps, and more than nothing
+			assert 0.0 < interactive.draw_time < 0.2
+			drawn = interactive.draw_time
+
+			# Executing is not drawing
+			ctrl.queue.put((ENTER, True))
+			time.sleep(0.5)
+			assert interactive.draw_time == drawn
+		finally:
+			ctrl.queue.put((BACK, True))
+			thread.join(1)
+		assert not thread.is_alive()
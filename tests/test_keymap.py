@@ -0,0 +1,62 @@
+import json
+import logging
+
+import pytest
+
+from conftest import module
+
+pytest.importorskip("inotify_simple")
+keymap = module("keymap")
+event = module("event")
+remote = module("remote")
+
+Keymap = keymap.Keymap
+Types = event.EventTypes
+Codes = event.EventCodes
+
+def test_resolve():
+	assert Keymap.resolve(Keymap.EVENT, "BTN_A") == (Types.EV_KEY, Codes.BTN_A)
+	assert Keymap.resolve(Keymap.EVENT, "REL_WHEEL") == (Types.EV_REL, Codes.REL_WHEEL)
+	assert Keymap.resolve(Keymap.EVENT, "ABS_Y") == (Types.EV_ABS, Codes.ABS_Y)
+	assert Keymap.resolve(Keymap.REMOTE, "KEY_OK") == (0, remote.KeyCodes.KEY_OK)
+	for source, name in [(Keymap.EVENT, "SYN_REPORT"), (Keymap.EVENT, "KEY_NOPE"), ("joystick", "KEY_UP")]:
+		with pytest.raises(ValueError):
+			Keymap.resolve(source, name)
+
+def test_compile():
+	table = Keymap({Keymap.EVENT: {"enter": ["BTN_A", "KEY_ENTER"]}, Keymap.REMOTE: {"back": ["KEY_BACK"]}}).table
+	assert table == {
+		(Keymap.EVENT, Types.EV_KEY, Codes.BTN_A): "enter",
+		(Keymap.EVENT, Types.EV_KEY, Codes.KEY_ENTER): "enter",
+		(Keymap.REMOTE, 0, remote.KeyCodes.KEY_BACK): "back",
+	}
+	for bindings in [{Keymap.EVENT: {"jump": ["BTN_A"]}}, {Keymap.EVENT: {"enter": "BTN_A"}}]:
+		with pytest.raises(ValueError):
+			Keymap(bindings)
+
+def test_load_overrides(tmp_path):
+	path = tmp_path / "keymap.json"
+	path.write_text(json.dumps({"event": {"enter": ["BTN_X"]}}))
+	table = Keymap.load(str(path)).table
+	assert table[(Keymap.EVENT, Types.EV_KEY, Codes.BTN_X)] == "enter"
+	assert (Keymap.EVENT, Types.EV_KEY, Codes.BTN_A) not in table
+	# The other actions keep their defaults
+	assert table[(Keymap.EVENT, Types.EV_KEY, Codes.BTN_B)] == "back"
+	assert table[(Keymap.REMOTE, 0, remote.KeyCodes.KEY_OK)] == "enter"
+
+def test_load_missing(tmp_path):
+	assert Keymap.load(str(tmp_path / "keymap.json")).table == Keymap().table
+
+@pytest.mark.parametrize("content", [
+	"{",
+	"[]",
+	json.dumps({"event": ["BTN_A"]}),
+	json.dumps({"event": {"enter": ["BTN_SOUTH"]}}),
+	json.dumps({"event": {"enter": [1]}}),
+])
+def test_load_broken(tmp_path, caplog, content):
+	path = tmp_path / "keymap.json"
+	path.write_text(content)
+	with caplog.at_level(logging.ERROR):
+		assert Keymap.load(str(path)).table == Keymap().table
+	assert "Ignoring keymap" in caplog.text
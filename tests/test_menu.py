@@ -0,0 +1,93 @@
+from conftest import module
+
+menu_module = module("menu")
+render = module("render")
+
+class RowRenderer(render.RecordingRenderer):
+	"""Also records the lines written."""
+	def __init__(self, lines=24, columns=80):
+		super().__init__(lines, columns)
+		self.rows = set()
+
+	def write(self, y, x, text, style=render.Renderer.NORMAL):
+		super().write(y, x, text, style)
+		self.rows.add(y)
+
+	def reset(self):
+		super().reset()
+		self.rows.clear()
+
+def sub_menu(items, lines=24):
+	"""A sub menu painted without a render thread."""
+	renderer = RowRenderer(lines)
+	sub = menu_module.Menu(renderer=renderer).sub_menu()
+	for i in range(items):
+		sub.add(str(i), "Item {}".format(i), None, id=i)
+	sub.paint()
+	renderer.reset()
+	return sub, renderer
+
+def test_jump_paints_two_rows():
+	sub, renderer = sub_menu(10)
+	sub.jump(3)
+	sub.paint()
+	assert renderer.rows == {0, 3}
+	assert renderer.calls["erase"] == 0
+	assert renderer.calls["clear_line"] == 2
+	renderer.reset()
+	# Nothing changed
+	sub.paint()
+	assert not renderer.rows
+
+def test_scroll_at_ends():
+	sub, renderer = sub_menu(100, lines=10)
+	# Wraps around to the last row
+	sub.jump(-1)
+	sub.paint()
+	assert (sub.curr, sub.top) == (99, 90)
+	assert renderer.rows == set(range(10))
+	renderer.reset()
+	sub.jump(1)
+	sub.paint()
+	assert (sub.curr, sub.top) == (0, 0)
+	assert renderer.rows == set(range(10))
+	renderer.reset()
+	# Within the screen nothing scrolls
+	sub.jump(9)
+	sub.paint()
+	assert sub.top == 0
+	assert renderer.rows == {0, 9}
+	renderer.reset()
+	sub.jump(1)
+	sub.paint()
+	assert sub.top == 1
+	assert renderer.calls["erase"] == 1
+	assert renderer.rows == set(range(10))
+
+def test_scroll_after_remove():
+	sub, renderer = sub_menu(30, lines=10)
+	sub.jump(-1)
+	sub.paint()
+	assert sub.top == 20
+	# Fewer rows than top and height, still a full screen
+	for i in range(29, 14, -1):
+		sub.remove(i)
+	renderer.reset()
+	sub.paint()
+	assert (len(sub.menu), sub.curr, sub.top) == (15, 14, 5)
+	assert renderer.rows == set(range(10))
+	# Fewer rows than the screen
+	for i in range(14, 3, -1):
+		sub.remove(i)
+	renderer.reset()
+	sub.paint()
+	assert (len(sub.menu), sub.curr, sub.top) == (4, 3, 0)
+	assert renderer.rows == set(range(4))
+	assert renderer.calls["erase"] == 1
+	# Removing without scrolling clears the row left empty
+	sub.remove(0)
+	renderer.reset()
+	sub.paint()
+	assert sub.top == 0
+	assert renderer.rows == {0, 1, 2}
+	assert renderer.calls["clear_line"] == 4
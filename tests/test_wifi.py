@@ -0,0 +1,148 @@
+import os
+import threading
+import time
+
+import pytest
+
+from conftest import module, FAKES
+
+wifi = module("wifi")
+
+EVENTS = [
+	"wlan0: deactivating",
+	"wlan0: disconnected",
+	"Networkmanager is now in the 'disconnected' state",
+	"Connectivity is now 'none'",
+	"There's no primary connection",
+	"wlan0: connecting (prepare)",
+	"wlan0: using connection 'Cafe'",
+	"wlan0: connecting (getting IP configuration)",
+	"wlan0: connected",
+	"'Cafe' is now the primary connection",
+	"Networkmanager is now in the 'connected (site only)' state",
+	"Cafe: connection profile changed",
+]
+
+@pytest.fixture
+def fake(monkeypatch, tmp_path):
+	monkeypatch.setenv("PATH", "{}:{}".format(FAKES, os.environ["PATH"]))
+	monkeypatch.setenv("FAKE_NM_LOG", str(tmp_path / "log"))
+	return tmp_path
+
+def wait(condition, timeout=2.0):
+	end = time.monotonic() + timeout
+	while not condition() and time.monotonic() < end:
+		time.sleep(0.01)
+	return condition()
+
+def test_monitor_starting_state(fake):
+	monitor = wifi.NetworkMonitor()
+	try:
+		assert monitor.online
+		assert monitor.connectivity == "full"
+		assert monitor.devices == {"wlan0": "connected", "eth0": "unavailable", "lo": "unmanaged"}
+		assert monitor.wifi_devices() == ["wlan0"]
+		assert monitor.connections == {"wlan0": "Home"}
+	finally:
+		monitor.close()
+
+def test_monitor_feed(fake, monkeypatch):
+	events = fake / "events"
+	events.write_text("\n".join(EVENTS) + "\n")
+	monkeypatch.setenv("FAKE_NM_EVENTS", str(events))
+	monitor = wifi.NetworkMonitor()
+	changes = []
+	monitor.subscribers.append(lambda kind, value: changes.append((kind, value)))
+	try:
+		assert wait(lambda: len(changes) == len(EVENTS))
+	finally:
+		monitor.close()
+	assert changes == [
+		("device", ("wlan0", "deactivating")),
+		("device", ("wlan0", "disconnected")),
+		("state", "disconnected"),
+		("connectivity", "none"),
+		("primary", None),
+		("device", ("wlan0", "connecting (prepare)")),
+		("connection", ("wlan0", "Cafe")),
+		("device", ("wlan0", "connecting (getting IP configuration)")),
+		("device", ("wlan0", "connected")),
+		("primary", "Cafe"),
+		("state", "connected (site only)"),
+		("profile", ("Cafe", "changed")),
+	]
+	assert monitor.connected and not monitor.online
+	assert monitor.primary == "Cafe"
+	assert monitor.connections == {"wlan0": "Cafe"}
+
+def test_is_online_without_monitor(fake):
+	assert wifi.WiFi().is_online()
+
+def test_scan_groups_bssids(fake):
+	networks = wifi.WiFi.group(wifi.WiFi().get_networks())
+	assert [(network["ssid"], network["bssid"], network["in-use"]) for network in networks] == [
+		("Home", "AA:00:00:00:00:02", True),
+		("Cafe", "AA:00:00:00:00:03", False),
+		("", "AA:00:00:00:00:04", False),
+	]
+	assert networks[0]["bssids"] == ["AA:00:00:00:00:02", "AA:00:00:00:00:01"]
+
+def test_connection_index(fake):
+	index = wifi.ConnectionIndex()
+	index.build()
+	assert len(index) == 2
+	# The latest used profile of the SSID
+	assert index.find("Home")["uuid"] == "11111111-aaaa"
+	assert index.find(bssid="AA:00:00:00:00:02")["name"] == "Home"
+	assert index.get("33333333-cccc")["bssids"] == []
+	assert index.find("Cafe") is None
+
+def test_connect_by_profile(fake):
+	network = wifi.WiFi()
+	assert network.connect("Home", bssid="AA:00:00:00:00:02")
+	assert network.connect("Cafe", bssid="AA:00:00:00:00:03")
+	log = (fake / "log").read_text().splitlines()
+	assert "con up uuid 11111111-aaaa" in log
+	assert "dev wifi connect AA:00:00:00:00:03" in log
+	assert not any(line.startswith("dev wifi list") for line in log)
+
+def test_connection_index_rebuilt_on_change(fake):
+	monitor = wifi.NetworkMonitor()
+	try:
+		index = wifi.ConnectionIndex(monitor)
+		assert index.find("Home")
+		builds = lambda: (fake / "log").read_text().splitlines().count("-t -g name,uuid,type,timestamp con show")
+		assert builds() == 1
+		monitor.feed("Home: connection profile changed")
+		assert wait(lambda: builds() == 2)
+	finally:
+		monitor.close()
+
+def test_menu_open_time_until_frame_drawn(fake):
+	pytest.importorskip("inotify_simple")
+	main = module("__main__")
+	render = module("render")
+	menu_module = module("menu")
+	renderer = render.RecordingRenderer()
+	menu = menu_module.Menu(fps=20, renderer=renderer)
+	ctrl = main.Input(queue=main.EventQueue())
+	with menu:
+		wifi_menu = main.WiFiMenu(menu.sub_menu(), ctrl)
+		for cached in [False, True]:
+			wifi_menu.open_time = None
+			renderer.reset()
+			thread = threading.Thread(target=wifi_menu, daemon=True)
+			thread.start()
+			try:
+				assert wait(lambda: wifi_menu.open_time is not None)
+				# A frame of the menu was drawn, within a frame at 20 fps
+				assert renderer.calls["flush"] and renderer.bytes
+				assert 0.0 < wifi_menu.open_time < 0.2
+				if cached:
+					assert [item.text for item in wifi_menu.menu.menu] == ["Back", "Home", "Cafe", ""]
+				assert wait(lambda: len(wifi_menu.menu.menu) == 4)
+			finally:
+				ctrl.queue.put((2, True))
+				thread.join(1)
+			assert not thread.is_alive()
+	wifi_menu.wifi.monitor.close()
@@ -1,14 +1,280 @@
 from subprocess import Popen, PIPE
 import re
+import threading
+import time
+
+# Lines of nmcli monitor
+STATE = re.compile(r"Networkmanager is now in the '(.*)' state")
+CONNECTIVITY = re.compile(r"Connectivity is now '(.*)'")
+PRIMARY = re.compile(r"'(.*)' is now the primary connection")
+NO_PRIMARY = re.compile(r"There's no primary connection")
+PROFILE = re.compile(r"(.*): connection profile (created|changed|removed)")
+USING = re.compile(r"(\S+): using connection '(.*)'")
+DEVICE_STATE = re.compile(r"(\S+): (.+)")
+
+class NetworkMonitor:
+	"""
+	NetworkManager state, kept up to date by one long lived
+	nmcli monitor. Subscribers are called with (kind, value):
+	- ("state", state)
+	- ("connectivity", connectivity)
+	- ("primary", connection or None)
+	- ("device", (device, state))
+	- ("connection", (device, connection))
+	- ("profile", (connection, "created"|"changed"|"removed"))
+	"""
+	def __init__(self):
+		self.state = None
+		self.connectivity = None
+		self.primary = None
+		self.devices = {}
+		self.types = {}
+		self.connections = {}
+		self.subscribers = []
+		self.ready = threading.Event()
+		self._process = None
+		self._runner = True
+		threading.Thread(target=self._run, daemon=True).start()
+
+	@property
+	def online(self):
+		"""Connected with full connectivity."""
+		# Just started, wait for the first state
+		self.ready.wait(2.0)
+		return self.state == "connected"
+
+	@property
+	def connected(self):
+		"""Connected, but maybe only to the local network."""
+		self.ready.wait(2.0)
+		return self.state is not None and self.state.startswith("connected")
+
+	def wifi_devices(self):
+		return [device for device, type in self.types.items() if type == "wifi"]
+
+	def _notify(self, kind, value):
+		for subscriber in list(self.subscribers):
+			subscriber(kind, value)
+
+	def _load(self):
+		"""The state to start from."""
+		out = WiFi.nmcli("-t", "-g", "state,connectivity", "g").communicate()[0]
+		state = re.split(r'(?<!\\):', out.decode('utf-8').strip())
+		if len(state) == 2:
+			self.state, self.connectivity = state
+		out = WiFi.nmcli("-t", "-g", "device,type,state,connection", "dev").communicate()[0]
+		for line in out.decode('utf-8').splitlines():
+			device = re.split(r'(?<!\\):', line)
+			if len(device) == 4:
+				self.types[device[0]] = device[1]
+				self.devices[device[0]] = device[2]
+				if device[3]:
+					self.connections[device[0]] = device[3].replace('\\', '')
+
+	def _run(self):
+		while self._runner:
+			try:
+				self._process = WiFi.nmcli("monitor")
+				self._load()
+				self.ready.set()
+				for line in self._process.stdout:
+					self.feed(line.decode('utf-8').strip())
+				self._process.wait()
+			except OSError:
+				self.ready.set()
+			# Restart it, but not too fast
+			time.sleep(1.0)
+
+	def feed(self, line):
+		"""Updates from a line of nmcli monitor."""
+		m = STATE.fullmatch(line)
+		if m:
+			self.state = m.group(1)
+			self._notify("state", self.state)
+			return
+		m = CONNECTIVITY.fullmatch(line)
+		if m:
+			self.connectivity = m.group(1)
+			self._notify("connectivity", self.connectivity)
+			return
+		m = PRIMARY.fullmatch(line)
+		if m or NO_PRIMARY.fullmatch(line):
+			self.primary = m.group(1) if m else None
+			self._notify("primary", self.primary)
+			return
+		m = PROFILE.fullmatch(line)
+		if m:
+			self._notify("profile", m.groups())
+			return
+		m = USING.fullmatch(line)
+		if m:
+			self.connections[m.group(1)] = m.group(2)
+			self._notify("connection", m.groups())
+			return
+		m = DEVICE_STATE.fullmatch(line)
+		if m:
+			device, state = m.groups()
+			self.devices[device] = state
+			if state == "disconnected":
+				self.connections.pop(device, None)
+			self._notify("device", (device, state))
+
+	def close(self):
+		self._runner = False
+		if self._process and self._process.poll() is None:
+			self._process.terminate()
+
+class ConnectionIndex:
+	"""
+	Saved connection profiles of NetworkManager by UUID, SSID
+	and BSSID. Built in the background, and again when the
+	monitor sees a profile change.
+	"""
+	def __init__(self, monitor=None):
+		self._lock = threading.Lock()
+		self._built = threading.Event()
+		self._by_uuid = {}
+		self._by_ssid = {}
+		self._by_bssid = {}
+		if monitor:
+			monitor.subscribers.append(self._changed)
+		threading.Thread(target=self.build, daemon=True).start()
+
+	def _changed(self, kind, value):
+		if kind == "profile":
+			threading.Thread(target=self.build, daemon=True).start()
+
+	def build(self):
+		profiles = []
+		try:
+			out = WiFi.nmcli("-t", "-g", "name,uuid,type,timestamp", "con", "show").communicate()[0]
+			for line in out.decode('utf-8').splitlines():
+				fields = re.split(r'(?<!\\):', line)
+				if len(fields) != 4 or fields[2] != "802-11-wireless":
+					continue
+				name, uuid, _, timestamp = fields
+				out = WiFi.nmcli("-t", "-g", "802-11-wireless.ssid,802-11-wireless.seen-bssids", "con", "show", "uuid", uuid).communicate()[0]
+				wireless = out.decode('utf-8').strip().split('\n')
+				profiles.append({
+					"name": name.replace('\\', ''),
+					"uuid": uuid,
+					"ssid": wireless[0].replace('\\', '') if wireless else "",
+					"bssids": [bssid.replace('\\', '') for bssid in wireless[1].split(',') if bssid] if len(wireless) > 1 else [],
+					"timestamp": int(timestamp) if timestamp.isdigit() else 0
+				})
+		except OSError:
+			pass
+		by_uuid = {}
+		by_ssid = {}
+		by_bssid = {}
+		# The latest used wins
+		for profile in sorted(profiles, key=lambda profile: profile["timestamp"]):
+			by_uuid[profile["uuid"]] = profile
+			by_ssid[profile["ssid"]] = profile
+			for bssid in profile["bssids"]:
+				by_bssid[bssid] = profile
+		with self._lock:
+			self._by_uuid, self._by_ssid, self._by_bssid = by_uuid, by_ssid, by_bssid
+		self._built.set()
+
+	def get(self, uuid):
+		return self._by_uuid.get(uuid)
+
+	def find(self, ssid=None, bssid=None, timeout=5.0):
+		"""The profile for the BSSID, or else the SSID."""
+		self._built.wait(timeout)
+		with self._lock:
+			profile = self._by_bssid.get(bssid) if bssid else None
+			if not profile and ssid:
+				profile = self._by_ssid.get(ssid)
+			return profile
+
+	def __len__(self):
+		return len(self._by_uuid)
 
 class WiFi:
 	"""
 	Keep track of the available Wi-Fi:s.
+	Scans are cached for TTL seconds, and a stale result is
+	returned while a new scan is made in the background.
 	"""
+	TTL = 30.0
+
+	def __init__(self, monitor=None):
+		self.monitor = monitor
+		self.connections = ConnectionIndex(monitor)
+		# Duration of the latest connect
+		self.connect_time = None
+		self._lock = threading.Lock()
+		self._networks = None
+		self._scanned = 0.0
+		self._scanning = False
+		self.subscribers = []
+		# Duration of the latest scan
+		self.scan_time = None
+
+	def scan(self, callback=None):
+		"""
+		Returns the cached networks, or None if never scanned.
+		A new scan is started if they are too old, and the
+		subscribers and callback are called with the result.
+		"""
+		with self._lock:
+			networks = self._networks
+			stale = time.monotonic() - self._scanned > self.TTL
+			if stale and not self._scanning:
+				self._scanning = True
+				threading.Thread(target=self._scan, args=(callback,), daemon=True).start()
+			elif stale and callback:
+				# Wait for the current scan
+				self.subscribers.append(self._once(callback))
+		return networks
+
+	def _once(self, callback):
+		def f(networks):
+			self.subscribers.remove(f)
+			callback(networks)
+		return f
+
+	def _scan(self, callback):
+		start = time.monotonic()
+		try:
+			networks = self.group(self.get_networks())
+		except OSError:
+			networks = None
+		with self._lock:
+			self._scanning = False
+			if networks is not None:
+				self._networks = networks
+				self._scanned = time.monotonic()
+				self.scan_time = self._scanned - start
+			else:
+				networks = self._networks
+		for subscriber in list(self.subscribers):
+			subscriber(networks)
+		if callback:
+			callback(networks)
+
+	@staticmethod
+	def group(networks):
+		"""
+		One network for each SSID with the strongest signal, and
+		every BSSID in "bssids". Strongest first.
+		"""
+		ssids = {}
+		for network in sorted(networks, key=lambda network: -network["signal"]):
+			# Hidden networks are only known by their BSSID
+			name = network["ssid"] if network["ssid"] else network["bssid"]
+			if name in ssids:
+				ssids[name]["bssids"].append(network["bssid"])
+				ssids[name]["in-use"] |= network["in-use"]
+			else:
+				ssids[name] = dict(network, bssids=[network["bssid"]])
+		return list(ssids.values())
+
 	def get_networks(self):
 		p = self.nmcli("-g", "in-use,bssid,ssid,chan,signal", "dev", "wifi", "list")
-		p.wait()
-		data = list(p.stdout.readlines())
+		data = p.communicate()[0].splitlines()
 		networks = []
 		for datum in data:
 			datum = datum.decode('utf-8').rstrip()
@@ -22,22 +288,30 @@ class WiFi:
 			})
 		return networks
 
-	def connect(self, ssid, password=None):
-		"""Connect with (b)ssid with or without password"""
+	def connect(self, ssid, password=None, bssid=None):
+		"""
+		Connect with (b)ssid with or without password. Saved
+		networks are brought up by their profile, without a scan.
+		"""
+		start = time.monotonic()
 		if password == True:
 			password = input("Password: ")
-		if password:
-			self.nmcli("dev", "wifi", "connect", ssid, "password", password).wait()
-		else:
-			# TODO: Check if it works, otherwise request password
-			self.nmcli("con", "up", ssid).wait()
-
-	@classmethod
-	def is_online(cls):
-		p = cls.nmcli("-g", "state", "g")
-		p.wait()
-		return p.readline().decode('utf-8').strip() == "connected"
+		profile = None if password else self.connections.find(ssid, bssid)
+		connected = False
+		if profile:
+			connected = self.nmcli("con", "up", "uuid", profile["uuid"]).wait() == 0
+		if not connected:
+			args = ["password", password] if password else []
+			# TODO: Request password if needed
+			connected = self.nmcli("dev", "wifi", "connect", bssid if bssid else ssid, *args).wait() == 0
+		self.connect_time = time.monotonic() - start
+		return connected
 
+	def is_online(self):
+		if self.monitor:
+			return self.monitor.online
+		p = self.nmcli("-g", "state", "g")
+		return p.communicate()[0].decode('utf-8').strip() == "connected"
 
 	@staticmethod
 	def nmcli(*args, **kwargs):